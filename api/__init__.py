@@ -1,15 +1,72 @@
 import os
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
+from sqlalchemy import event, exc
+from sqlalchemy.pool import Pool
 from config import app_config
+from api import instrumentation, metrics, pooling, replicas
 
-app = Flask('__name__')
+DEFAULT_CONFIG = 'production'
 
-CORS(app)
-jwt = JWTManager(app)
-app.config.from_object(app_config['development'])
-app.url_map.strict_slashes = False
+# Extensions are bound to an app by create_app, the engine and its pool
+# are only built on the first query. Sessions route reads to the replicas
+# of the config, see api.replicas.
+jwt = JWTManager()
+db = replicas.RoutingSQLAlchemy()
+cors = CORS()
 
-db = SQLAlchemy(app)
+
+def config_name_from_env():
+    """Picks the config from FLASK_CONFIG, then FLASK_ENV, production otherwise"""
+    for name in (os.getenv('FLASK_CONFIG'), os.getenv('FLASK_ENV')):
+        if name in app_config:
+            return name
+    return DEFAULT_CONFIG
+
+
+def create_app(config_name=None):
+    """Application factory, the config is picked from the environment by default"""
+    app = Flask('__name__')
+    app.config.from_object(app_config[config_name or config_name_from_env()])
+    app.url_map.strict_slashes = False
+    app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', pooling.engine_options(app.config))
+
+    cors.init_app(app)
+    jwt.init_app(app)
+    db.init_app(app)
+    instrumentation.init_app(app)
+    replicas.init_app(app)
+
+    from api import routes
+    app.register_blueprint(routes.mod)
+    app.register_blueprint(metrics.mod)
+    return app
+
+
+def dispose_engines(app):
+    """
+    Drops the connections a forked worker inherited from its parent,
+    call it once in every child, e.g. from gunicorn's post_fork hook.
+    """
+    with app.app_context():
+        for bind in [None] + list(app.config.get('SQLALCHEMY_BINDS') or ()):
+            db.get_engine(app, bind).dispose()
+    replicas.dispose(app)
+
+
+@event.listens_for(Pool, 'connect')
+def _remember_pid(dbapi_connection, connection_record):
+    """Tags a new pooled connection with the process that opened it"""
+    connection_record.info['pid'] = os.getpid()
+
+
+@event.listens_for(Pool, 'checkout')
+def _check_pid(dbapi_connection, connection_record, connection_proxy):
+    """Never hands a connection opened by a parent process to a forked child"""
+    pid = os.getpid()
+    if connection_record.info.get('pid', pid) != pid:
+        connection_record.dbapi_connection = connection_proxy.dbapi_connection = None
+        raise exc.DisconnectionError(
+            'Connection record belongs to pid %s, attempting to check out in pid %s'
+            % (connection_record.info['pid'], pid))
@@ -0,0 +1,168 @@
+"""Streaming bulk import of books from CSV or JSONL sources"""
+
+import csv
+import io
+import json
+
+from api import db
+from api.cache import bump_catalog_version
+from api.models import Book
+from api.admin.validate import validate_book
+from sqlalchemy.exc import IntegrityError
+
+BATCH_SIZE = 1000
+# Cap on the number of rejected rows reported back in detail
+REJECT_REPORT_LIMIT = 1000
+BOOK_FIELDS = ('title', 'author', 'isbn', 'publisher', 'quantity')
+
+
+class UnreadableImport(ValueError):
+    """Raised when the import data can't be decoded, report holds the batches imported before"""
+
+    def __init__(self, message, report):
+        """Init function"""
+        super().__init__(message)
+        self.report = report
+
+
+def detect_format(filename, content_type=None):
+    """Guesses the import format from a file name or content type"""
+    name = (filename or '').lower()
+    content_type = (content_type or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')) or 'ndjson' in content_type or 'jsonl' in content_type:
+        return 'jsonl'
+    return 'csv'
+
+
+def read_rows(stream, fmt='csv'):
+    """
+    Lazily yields (line number, row) pairs from a text stream.
+    Rows that cannot be parsed are yielded as None so they get reported.
+    """
+    if fmt == 'jsonl':
+        for line_no, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_no, row if isinstance(row, dict) else None
+        return
+    reader = csv.DictReader(stream)
+    for row in reader:
+        yield reader.line_num, row
+
+
+def text_stream(binary_stream, encoding='utf-8'):
+    """Wraps a binary upload stream so it can be read line by line"""
+    return io.TextIOWrapper(binary_stream, encoding=encoding, newline='')
+
+
+def clean_row(row):
+    """Validates and normalizes one row, returns (book, errors)"""
+    if row is None:
+        return None, {"row": ["could not be parsed"]}
+    data = {field: row.get(field) for field in BOOK_FIELDS}
+    errors = validate_book(data)
+    if errors:
+        return None, errors
+    if len(data['isbn']) not in (10, 13):
+        return None, {"isbn": ["Invalid ISBN"]}
+    quantity = data['quantity']
+    # int() would truncate 3.7 and take true as 1
+    if isinstance(quantity, bool) or (isinstance(quantity, float) and not quantity.is_integer()):
+        return None, {"quantity": ["must be an integer"]}
+    try:
+        data['quantity'] = int(quantity)
+    except (TypeError, ValueError):
+        return None, {"quantity": ["must be an integer"]}
+    if data['quantity'] < 0:
+        return None, {"quantity": ["must not be negative"]}
+    return data, None
+
+
+def _existing_isbns(isbns):
+    """Gets the ISBNs already in the catalog"""
+    return {isbn for isbn, in db.session.query(Book.isbn).filter(Book.isbn.in_(list(isbns)))}
+
+
+def _insert(books):
+    """Inserts books in one statement and commits"""
+    # A list of parameter sets is sent as a multi-row INSERT by the
+    # psycopg2 dialect instead of one statement per book.
+    db.session.execute(Book.__table__.insert(), books)
+    db.session.commit()
+
+
+def _insert_each(rows, report):
+    """Inserts (line number, book) pairs one at a time, rejecting those that conflict"""
+    imported = 0
+    for line_no, book in rows:
+        try:
+            _insert([book])
+            imported += 1
+        except IntegrityError:
+            db.session.rollback()
+            _reject(report, line_no, book['isbn'], {"isbn": ["Book already exists"]})
+    return imported
+
+
+def _flush(batch, report):
+    """Inserts one batch, skipping ISBNs that already exist in the catalog"""
+    if not batch:
+        return
+    existing = _existing_isbns(batch)
+    rows = []
+    for isbn, (line_no, book) in batch.items():
+        if isbn in existing:
+            _reject(report, line_no, isbn, {"isbn": ["Book already exists"]})
+            continue
+        rows.append((line_no, book))
+    if rows:
+        try:
+            _insert([book for _, book in rows])
+            imported = len(rows)
+        except IntegrityError:
+            # A concurrent import or add took one of the ISBNs since the lookup
+            db.session.rollback()
+            imported = _insert_each(rows, report)
+        if imported:
+            bump_catalog_version()
+            report['imported'] += imported
+    batch.clear()
+
+
+def _reject(report, line_no, isbn, errors):
+    """Records a rejected row without stopping the load"""
+    report['rejected'] += 1
+    if len(report['errors']) < REJECT_REPORT_LIMIT:
+        report['errors'].append({"line": line_no, "isbn": isbn, "errors": errors})
+
+
+def import_books(rows, batch_size=BATCH_SIZE):
+    """
+    Imports (line number, row) pairs in batches of batch_size.
+    Returns a report with imported and rejected counts and rejected row details,
+    raises UnreadableImport if the rows stop decoding.
+    """
+    report = {"imported": 0, "rejected": 0, "errors": []}
+    batch = {}
+    try:
+        for line_no, row in rows:
+            book, errors = clean_row(row)
+            if errors:
+                _reject(report, line_no, row.get('isbn') if row else None, errors)
+                continue
+            if book['isbn'] in batch:
+                _reject(report, line_no, book['isbn'], {"isbn": ["Duplicate ISBN in import"]})
+                continue
+            batch[book['isbn']] = (line_no, book)
+            if len(batch) >= batch_size:
+                _flush(batch, report)
+    except UnicodeDecodeError:
+        # The rows of the unfinished batch are dropped with the rest of the data
+        raise UnreadableImport("Import data must be UTF-8 encoded", report)
+    _flush(batch, report)
+    return report
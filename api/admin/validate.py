@@ -1,41 +1,60 @@
-from cerberus import Validator
-from flask import Response, json
+from datetime import datetime
+from api.validation import CompiledSchema
+from api.responses import json_response
 
 
-def validate_book(data):
-    schema = {
-        'title': {
-            'type': 'string',
-            'required': True,
-            'empty': False,
-            'maxlength': 500
-        },
-        'author': {
-            'type': 'string',
-            'required': True,
-            'empty': False,
-            'maxlength': 100
-        },
-        'isbn': {
-            'type': 'string',
-            'required': True,
-            'empty': False,
-            'maxlength': 100
-        },
-        'publisher': {
-            'type': 'string',
-            'empty': False,
-            'maxlength': 100
-        },
-        'quantity': {
-            # 'type': 'integer',
-            'empty': False,
-            'required': True
-        }
+BOOK_SCHEMA = CompiledSchema({
+    'title': {
+        'type': 'string',
+        'required': True,
+        'empty': False,
+        'maxlength': 500
+    },
+    'author': {
+        'type': 'string',
+        'required': True,
+        'empty': False,
+        'maxlength': 100
+    },
+    'isbn': {
+        'type': 'string',
+        'required': True,
+        'empty': False,
+        'maxlength': 100
+    },
+    'publisher': {
+        'type': 'string',
+        'empty': False,
+        'maxlength': 100
+    },
+    'quantity': {
+        # 'type': 'integer',
+        'empty': False,
+        'required': True
+    }
+})
+
+# Most usernames one role change may name
+MAX_ROLE_BATCH = 500
+
+ROLES_SCHEMA = CompiledSchema({
+    'usernames': {
+        'type': 'list',
+        'required': True,
+        'empty': False,
+        'maxlength': MAX_ROLE_BATCH,
+        'schema': {'type': 'string', 'empty': False, 'maxlength': 100}
+    },
+    'is_admin': {
+        'type': 'boolean',
+        'required': True
     }
-    validator = Validator(schema)
-    validator.validate(data)
-    errors = validator.errors
+})
+
+
+def validate_book(data):
+    """Validates book data, returns the errors or normalizes data in place"""
+    errors = BOOK_SCHEMA.errors(data)
     if errors:
         return errors
     data['title'] = data['title'].strip().lower().title()
@@ -44,8 +63,21 @@ def validate_book(data):
     data['publisher'] = data['publisher'].strip().title()
 
 
+def validate_roles(data):
+    """Validates a role change, returns the errors or lowercases the usernames in place"""
+    errors = ROLES_SCHEMA.errors(data)
+    if errors:
+        return errors
+    data['usernames'] = [username.strip().lower() for username in data['usernames']]
+
+
 def validate_arg(arg):
     try:
         arg = int(arg)
     except Exception as e:
-        return Response(json.dumps({"Message": "Invalid argument passed"}), status=400)
+        return json_response({"Message": "Invalid argument passed"}, status=400)
+
+
+def parse_date(value):
+    """Parses an optional YYYY-MM-DD query argument"""
+    return datetime.strptime(value, '%Y-%m-%d').date() if value else None
@@ -1,11 +1,19 @@
 """File has admin endpoints resources"""
 
-from api import jwt
-from api.models import Book, User, ReviewBook
-from api.admin.validate import validate_book, validate_arg
+from api import jwt, db
+from api.identity import current_user, is_admin
+from api.models import Book, User, ReviewBook, LastAdmin
+from api.admin.validate import validate_book, validate_roles, validate_arg, parse_date
+from api.admin.importer import import_books, read_rows, text_stream, detect_format, UnreadableImport
+from api.pagination import positive_arg
+from api.responses import json_response
 from flask_restful import Resource
-from flask import json, request, Response
-from flask_jwt_extended import get_jwt_identity, jwt_required
+from flask import request
+from flask_jwt_extended import jwt_required
+from sqlalchemy.exc import IntegrityError
+
+# Largest page of outstanding reviews a request may ask for
+MAX_OUTSTANDING_PAGE = 1000
 
 
 class AddBook(Resource):
@@ -14,24 +22,53 @@ class AddBook(Resource):
     @jwt_required
     def post(self):
         """Method serving add book api endpoint"""
-        current_user = get_jwt_identity()
-        user = User.get_user_by_username(current_user)
+        user = current_user()
         if user:
-            if user.is_admin:
+            if is_admin(user):
                 data = request.get_json(self)
-                if validate_book(data):
-                    return Response(json.dumps(validate_book(data)), status=400)
+                errors = validate_book(data)
+                if errors:
+                    return json_response(errors, status=400)
                 if len(data['isbn']) not in (10, 13):
-                    return Response(json.dumps({"Message": "Invalid ISBN"}), status=403)
-                isbn = Book.query.filter_by(isbn=data['isbn']).first()
-                if isbn:
-                    return Response(json.dumps({"Message": "Book already exists"}), status=409)
-                Book(data['title'], data['author'], data['isbn'],
-                     data['publisher'], data['quantity']).save()
-                book = Book.query.filter_by(isbn=data['isbn']).first()
-                return Response(json.dumps({"Message": "Book added successfully", "Book": book.serialize}), status=201)
-            return Response(json.dumps({"Message": "User not an admin"}), status=401)
-        return Response(json.dumps({"Message": "User does not exist"}), status=404)
+                    return json_response({"Message": "Invalid ISBN"}, status=403)
+                book = Book(data['title'], data['author'], data['isbn'],
+                            data['publisher'], data['quantity'])
+                try:
+                    book.save()
+                except IntegrityError:
+                    # The unique index on isbn, no need to look the book up first
+                    db.session.rollback()
+                    return json_response({"Message": "Book already exists"}, status=409)
+                return json_response({"Message": "Book added successfully", "Book": book.serialize}, status=201)
+            return json_response({"Message": "User not an admin"}, status=401)
+        return json_response({"Message": "User does not exist"}, status=404)
+
+
+class ImportBooks(Resource):
+    """Bulk import books resource"""
+
+    @jwt_required
+    def post(self):
+        """Function serving bulk import books api endpoint"""
+        user = current_user()
+        if user:
+            if is_admin(user):
+                upload = request.files.get('file')
+                if upload:
+                    fmt = detect_format(upload.filename, upload.mimetype)
+                    stream = text_stream(upload.stream)
+                elif request.content_length:
+                    fmt = detect_format(None, request.mimetype)
+                    stream = text_stream(request.stream)
+                else:
+                    return json_response({"Message": "No import data provided"}, status=400)
+                try:
+                    report = import_books(read_rows(stream, fmt))
+                except UnreadableImport as e:
+                    return json_response({"Message": str(e), **e.report}, status=400)
+                return json_response({"Message": "Import finished", **report}, status=200)
+            return json_response({"Message": "User not an admin"}, status=401)
+        return json_response({"Message": "User does not exist"}, status=404)
 
 
 class BookOps(Resource):
@@ -40,17 +77,17 @@ class BookOps(Resource):
     @jwt_required
     def put(self, book_id):
         """Function serving edit book api endpoint"""
-        current_user = get_jwt_identity()
-        user = User.get_user_by_username(current_user)
+        user = current_user()
         if validate_arg(book_id):
             return validate_arg(book_id)
         if user:
-            if user.is_admin:
+            if is_admin(user):
                 book = Book.get_book_by_id(book_id)
                 if book:
                     data = request.get_json(self)
-                    if validate_book(data):
-                        return Response(json.dumps(validate_book(data)), status=403)
+                    errors = validate_book(data)
+                    if errors:
+                        return json_response(errors, status=403)
                     book.title = data['title']
                     book.author = data['author']
                     book.isbn = data['isbn']
@@ -58,32 +95,31 @@ class BookOps(Resource):
                     book.quantity = data['quantity']
                     book.save()
                     book = Book.get_book_by_id(book_id)
-                    return Response(json.dumps({"Message": "Book updated successfully", "Book": book.serialize}), status=200)
-                return Response(json.dumps({"Message": "Book does not exist"}), status=404)
-            return Response(json.dumps({"Message": "User not an admin"}), status=401)
-        return Response(json.dumps({"Message": "User does not exist"}), status=404)
+                    return json_response({"Message": "Book updated successfully", "Book": book.serialize}, status=200)
+                return json_response({"Message": "Book does not exist"}, status=404)
+            return json_response({"Message": "User not an admin"}, status=401)
+        return json_response({"Message": "User does not exist"}, status=404)
 
     @jwt_required
     def delete(self, book_id):
         """Function serving delete book api endpoint"""
-        current_user = get_jwt_identity()
-        user = User.get_user_by_username(current_user)
+        user = current_user()
         if validate_arg(book_id):
             return validate_arg(book_id)
         if user:
-            if user.is_admin:
+            if is_admin(user):
                 book = Book.get_book_by_id(book_id)
                 if book:
                     borrowed = ReviewBook.query.filter_by(
                         book_id=book_id).first()
                     if borrowed:
-                        return Response(json.dumps({"Message": "Book has been borrowed"}), status=403)
+                        return json_response({"Message": "Book has been borrowed"}, status=403)
                     else:
                         book.delete()
-                    return Response(json.dumps({"Message": "Book deleted successfully"}), status=200)
-                return Response(json.dumps({"Message": "Book doesn't exist"}), status=404)
-            return Response(json.dumps({"Message": "User not an admin"}), status=401)
-        return Response(json.dumps({"Message": "User does not exist"}), status=404)
+                    return json_response({"Message": "Book deleted successfully"}, status=200)
+                return json_response({"Message": "Book doesn't exist"}, status=404)
+            return json_response({"Message": "User not an admin"}, status=401)
+        return json_response({"Message": "User does not exist"}, status=404)
 
 
 class PromoteUser(Resource):
@@ -92,12 +128,73 @@ class PromoteUser(Resource):
     @jwt_required
     def post(self):
         """Function serving promote user api endpoint"""
-        current_user = get_jwt_identity()
-        user = User.get_user_by_username(current_user)
+        user = current_user()
         if not user:
-            return Response(json.dumps({"Message": "User does not exist"}), status=404)
-        if user.is_admin:
+            return json_response({"Message": "User does not exist"}, status=404)
+        if is_admin(user):
+            data = request.get_json(self)
+            if not User.promote_user(data['username'].lower()):
+                return json_response({"Message": "User to promote does not exist"}, status=404)
+            return json_response({"Message": "User promoted successfully"}, status=200)
+        return json_response({"Message": "User not an admin"}, status=401)
+
+
+class UserRoles(Resource):
+    """Grant or revoke admin for several users at once resource"""
+
+    @jwt_required
+    def post(self):
+        """Function serving bulk user roles api endpoint"""
+        user = current_user()
+        if not user:
+            return json_response({"Message": "User does not exist"}, status=404)
+        if is_admin(user):
             data = request.get_json(self)
-            User.promote_user(data['username'].lower())
-            return Response(json.dumps({"Message": "User promoted successfully"}), status=200)
-        return Response(json.dumps({"Message": "User not an admin"}), status=401)
\ No newline at end of file
+            errors = validate_roles(data)
+            if errors:
+                return json_response(errors, status=400)
+            try:
+                not_found = User.set_admin(data['usernames'], data['is_admin'])
+            except LastAdmin as e:
+                return json_response({"Message": str(e)}, status=409)
+            updated = sorted(set(data['usernames']).difference(not_found))
+            message = "{} of {} users updated".format(len(updated), len(updated) + len(not_found))
+            return json_response({"Message": message, "Updated": updated, "NotFound": not_found}, status=200)
+        return json_response({"Message": "User not an admin"}, status=401)
+
+
+class OutstandingReviews(Resource):
+    """Outstanding reviews of all users resource"""
+
+    @jwt_required
+    def get(self):
+        """Function serving list outstanding reviews api endpoint"""
+        user = current_user()
+        if not user:
+            return json_response({"Message": "User does not exist"}, status=404)
+        if user.is_admin:
+            try:
+                due_before = parse_date(request.args.get("due_before"))
+            except ValueError:
+                return json_response({"Message": "Dates must be in YYYY-MM-DD format"}, status=400)
+            try:
+                page = positive_arg(request.args.get("page"), 1)
+                limit = positive_arg(request.args.get("limit"), 50, MAX_OUTSTANDING_PAGE)
+            except ValueError:
+                return json_response(
+                    {"Message": "page must be a positive number and limit between 1 and {}".format(
+                        MAX_OUTSTANDING_PAGE)}, status=400)
+            outstanding = ReviewBook.get_all_outstanding(page=page, per_page=limit, due_before=due_before)
+            reviews = [{
+                "username": row.username,
+                "email": row.email,
+                "id": row.id,
+                "title": row.title,
+                "author": row.author,
+                "isbn": row.isbn,
+                "reviewDate": row.date_reviewed,
+                "dueDate": row.date_of_review,
+            } for row in outstanding.items]
+            return json_response({"Outstanding": reviews, "totalPages": outstanding.pages,
+                                  "currentPage": outstanding.page}, status=200)
+        return json_response({"Message": "User not an admin"}, status=401)
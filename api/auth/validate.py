@@ -1,51 +1,53 @@
-from cerberus import Validator
+from api.validation import CompiledSchema
 
-def validate_register(data):
-    schema = {
-        'email': {
-            'type': 'string',
-            'regex': '(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)',
-            'required': True,
-            'empty': False,
-            'maxlength': 60
-        },
-        'username': {
-            'type': 'string',
-            'required': True,
-            'empty': False,
-            'maxlength': 60
-        },
-        'first_name': {
-            'type': 'string',
-            'required': True,
-            'empty': False,
-            'maxlength': 60
-        },
-        'last_name': {
-            'type': 'string',
-            'required': True,
-            'empty': False,
-            'maxlength': 60
-        },
-        'password': {
-            'type': 'string',
-            # 'regex': '^(?=.*[A-Za-z])(?=.*\d)(?=.*[$@$!%*#?&])[A-Za-z\d$@$!%*#?&]{8,}$',
-            'required': True,
-            'minlength': 8,
-            'empty': False,
-            'maxlength': 20
-        },
-        'confirm_password': {
-            'type': 'string',
-            # 'regex': '',
-            'required': True,
-            'empty': False,
-            'maxlength': 20
-        }
+
+REGISTER_SCHEMA = CompiledSchema({
+    'email': {
+        'type': 'string',
+        'regex': '(^[a-zA-Z0-9_.+-]+@[a-zA-Z0-9-]+\.[a-zA-Z0-9-.]+$)',
+        'required': True,
+        'empty': False,
+        'maxlength': 60
+    },
+    'username': {
+        'type': 'string',
+        'required': True,
+        'empty': False,
+        'maxlength': 60
+    },
+    'first_name': {
+        'type': 'string',
+        'required': True,
+        'empty': False,
+        'maxlength': 60
+    },
+    'last_name': {
+        'type': 'string',
+        'required': True,
+        'empty': False,
+        'maxlength': 60
+    },
+    'password': {
+        'type': 'string',
+        # 'regex': '^(?=.*[A-Za-z])(?=.*\d)(?=.*[$@$!%*#?&])[A-Za-z\d$@$!%*#?&]{8,}$',
+        'required': True,
+        'minlength': 8,
+        'empty': False,
+        'maxlength': 20
+    },
+    'confirm_password': {
+        'type': 'string',
+        # 'regex': '',
+        'required': True,
+        'empty': False,
+        'maxlength': 20
     }
-    validator = Validator(schema)
-    validator.validate(data)
-    errors = validator.errors
+})
+
+
+def validate_register(data):
+    """Validates registration data, returns the errors or normalizes data in place"""
+    errors = REGISTER_SCHEMA.errors(data)
     if errors:
         return errors
     data['email'] = data['email'].replace(" ", "").lower()
@@ -53,42 +55,58 @@ def validate_register(data):
     data['first_name'] = data['first_name'].replace(" ", "")
     data['last_name'] = data['last_name'].replace(" ", "")
 
-def validate_login(data):
-    schema = {
-        'username': {
-            'type': 'string',
-            'required': True,
-            'empty': False
-        },
-        'password': {
-            'type': 'string',
-            'required': True,
-            'empty': False
-        }
+
+def login_precheck(data):
+    """
+    Cheap check accepting well formed login data without running Cerberus.
+    Anything it does not accept goes through LOGIN_SCHEMA for the error messages.
+    """
+    return (type(data) is dict and len(data) == 2
+            and type(data.get('username')) is str and data['username'] != ''
+            and type(data.get('password')) is str and data['password'] != '')
+
+
+LOGIN_SCHEMA = CompiledSchema({
+    'username': {
+        'type': 'string',
+        'required': True,
+        'empty': False
+    },
+    'password': {
+        'type': 'string',
+        'required': True,
+        'empty': False
     }
-    validator = Validator(schema)
-    validator.validate(data)
-    errors = validator.errors
+})
+
+
+def validate_login(data):
+    """Validates login data, returns the errors if any"""
+    if login_precheck(data):
+        return None
+    errors = LOGIN_SCHEMA.errors(data)
     if errors:
         return errors
 
-def validate_reset(data):
-    schema = {
-        'password': {
-            'type': 'string',
-            'required': True
-        },
-        'new_password': {
-            'type': 'string',
-            'required': True
-        },
-        'confirm_password': {
-            'type': 'string',
-            'required': True
-        }
+
+RESET_SCHEMA = CompiledSchema({
+    'password': {
+        'type': 'string',
+        'required': True
+    },
+    'new_password': {
+        'type': 'string',
+        'required': True
+    },
+    'confirm_password': {
+        'type': 'string',
+        'required': True
     }
-    validator = Validator(schema)
-    validator.validate(data)
-    errors = validator.errors
+})
+
+
+def validate_reset(data):
+    """Validates reset password data, returns the errors if any"""
+    errors = RESET_SCHEMA.errors(data)
     if errors:
         return errors
@@ -1,12 +1,15 @@
 """File with auth endpoints resources"""
 
-from api import jwt
-from api.models import User, Token, Revoked
+from api import jwt, db
+from api.models import User, Token
+from api.revocation import revoke, revoked_tokens
 from api.auth.validate import validate_register, validate_login
+from api.responses import json_response
 from flask_restful import Resource
-from datetime import timedelta
-from flask import json, request, Response
-from flask_jwt_extended import create_access_token, get_raw_jwt, get_jwt_identity, jwt_manager, jwt_required
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from flask import request
+from flask_jwt_extended import create_access_token, get_jti, get_raw_jwt, get_jwt_identity, jwt_manager, jwt_required
 
 
 class Register(Resource):
@@ -15,20 +18,24 @@ class Register(Resource):
     def post(self):
         """Function serving register user api endpoint"""
         data = request.get_json(self)
-        if validate_register(data):
-            return Response(json.dumps(validate_register(data)), status=400)
+        errors = validate_register(data)
+        if errors:
+            return json_response(errors, status=400)
         if data['password'] != data['confirm_password']:
-            return Response(json.dumps({"Message": "Password provided do not match"}), status=400)
-        users = User.all_users()
-        email = [user for user in users if user.email == data['email']]
-        if email:
-            return Response(json.dumps({"Message":"Email provided already exists"}), status=409)
-        username = [user for user in users if user.username == data['username']]
-        if username:
-            return Response(json.dumps({"Message":"Username provided already exists"}), status=409)
-        new_user = User(data['email'], data['username'], data['first_name'], data['last_name'], data['password'])
-        new_user.save()
-        return Response(json.dumps({"Message": "User Created Successfully"}), status=201)
+            return json_response({"Message": "Password provided do not match"}, status=400)
+        taken = User.taken_fields(data['email'], data['username'])
+        if not taken:
+            new_user = User(data['email'], data['username'], data['first_name'], data['last_name'], data['password'])
+            try:
+                new_user.save()
+                return json_response({"Message": "User Created Successfully"}, status=201)
+            except IntegrityError:
+                # A concurrent sign-up won the race, the unique indexes caught it
+                db.session.rollback()
+                taken = User.taken_fields(data['email'], data['username']) or {'email'}
+        if 'email' in taken:
+            return json_response({"Message":"Email provided already exists"}, status=409)
+        return json_response({"Message":"Username provided already exists"}, status=409)
 
 
 class Login(Resource):
@@ -37,22 +44,23 @@ class Login(Resource):
     def post(self):
         """Function serving login user api endpoint"""
         data = request.get_json(self)
-        data['username'] = data['username'].replace(" ", "").lower()
-        if validate_login(data):
-            return Response(json.dumps(validate_login(data)), status=400)
+        if isinstance(data, dict) and isinstance(data.get('username'), str):
+            data['username'] = data['username'].replace(" ", "").lower()
+        errors = validate_login(data)
+        if errors:
+            return json_response(errors, status=400)
         user = User.query.filter_by(username=data['username']).first()
         print(user)
         if user:
             if User.verify_password(user.secure_password, data['password']):
-                logged_in = Token.token_by_owner(user.username)
-                # if logged_in:
-                #     return Response(json.dumps({"Message": "Already logged in", "Token": logged_in.token}), status=403)
+                if User.needs_rehash(user.secure_password):
+                    user.update_password(data['password'])
                 expires = timedelta(days=30)
                 token = create_access_token(identity=user.username, expires_delta=expires)
-                tk = Token(token, user.username).save()
-                return Response(json.dumps({"Message": "Successfully logged in", "Token": token, "User": user.serialize}), status=200)
-            return Response(json.dumps({"Message": "Wrong password"}), status=401)
-        return Response(json.dumps({"Message": "User does not exist"}), status=404)
+                Token(get_jti(token), user.username, datetime.utcnow() + expires).save()
+                return json_response({"Message": "Successfully logged in", "Token": token, "User": user.serialize}, status=200)
+            return json_response({"Message": "Wrong password"}, status=401)
+        return json_response({"Message": "User does not exist"}, status=404)
 
 
 class Logout(Resource):
@@ -62,16 +70,15 @@ class Logout(Resource):
     def post(self):
         """Function handling logout user api endpoint"""
         try:
-            current_user = get_jwt_identity()
-            jti = get_raw_jwt()['jti']
-            if not Revoked.is_blacklisted(jti):
-                Revoked(jti).save()
-                Token.delete(Token.token_by_owner(current_user))
-                return Response(json.dumps({"Message": "Logged out successfully"}), status=200)
-            return Response(json.dumps({"Message": "User token has been revoked"}), status=403)
+            raw_jwt = get_raw_jwt()
+            if raw_jwt['jti'] not in revoked_tokens:
+                revoke(raw_jwt)
+                Token.delete_by_jti(raw_jwt['jti'])
+                return json_response({"Message": "Logged out successfully"}, status=200)
+            return json_response({"Message": "User token has been revoked"}, status=403)
         except Exception as e:
             print (e)
-            return Response(json.dumps({"Message": "Not logged in"}), status=401)
+            return json_response({"Message": "Not logged in"}, status=401)
 
 
 class ResetPassword(Resource):
@@ -82,24 +89,23 @@ class ResetPassword(Resource):
         """Function handling reset password api endpoint"""
         try:
             identity = get_jwt_identity()
-            jti = get_raw_jwt()['jti']
+            raw_jwt = get_raw_jwt()
             current_user = User.get_user_by_username(identity)
             data = request.get_json(self)
             # if validate_reset_password(data):
             #     return validate_reset_password(data)
-            if User.verify_password(current_user.password_hash, data["password"]):
+            if User.verify_password(current_user.secure_password, data["password"]):
                 try:
-                    current_user.password_hash = current_user.hash_password(data['new_password'])
-                    current_user.save()
+                    current_user.update_password(data['new_password'])
 
                 except Exception as e:
                     pass
                 finally:
                     # Revoke token after password change
-                    Revoked(jti).save()
-                    Token.delete(Token.token_by_owner(current_user))
-                    return Response(json.dumps({"Message": "Password updated successfully. Please login again."}), status=200)
-            return Response(json.dumps({"Message": "Password do not match"}), status=403)
+                    revoke(raw_jwt)
+                    Token.delete_by_jti(raw_jwt['jti'])
+                    return json_response({"Message": "Password updated successfully. Please login again."}, status=200)
+            return json_response({"Message": "Password do not match"}, status=403)
         except Exception as e:
             print(e)
-            return Response(json.dumps({"Message": "Not logged in"}), status=401)
\ No newline at end of file
+            return json_response({"Message": "Not logged in"}, status=401)
\ No newline at end of file
@@ -1,9 +1,16 @@
 """File has book api endpoints resources"""
 
 from api.models import Book
+from api.serializers import serialize_book
 from api.admin.validate import validate_arg
+from api.pagination import InvalidCursor, positive_arg
+from api.cache import cached_response
+from api.responses import json_response
 from flask_restful import Resource
-from flask import json, request, Response
+from flask import request
+
+# Largest page of books a request may ask for
+MAX_BOOK_PAGE = 1000
 
 
 class GetBooks(Resource):
@@ -11,22 +18,47 @@ class GetBooks(Resource):
 
     def get(self):
         """Function serving get all books api endpoint"""
+        key = ('books',) + tuple(sorted(request.args.items(multi=True)))
+        return cached_response(key, self.render)
+
+    def render(self):
+        """Builds the get all books response"""
         q = request.args.get("q")
-        print(q)
+        try:
+            page = positive_arg(request.args.get("page"), 1)
+            limit = positive_arg(request.args.get("limit"), 10, MAX_BOOK_PAGE)
+        except ValueError:
+            return json_response(
+                {"Message": "page must be a positive number and limit between 1 and {}".format(MAX_BOOK_PAGE)},
+                status=400)
+        if "after" in request.args and not q:
+            return self.get_after(request.args.get("after"), limit)
         if q:
-            return Response(json.dumps(Book.search(q)), status=200)
-        page = request.args.get("page")
-        page = int(page) if page else 1
-        limit = request.args.get("limit")
-        limit = int(limit) if limit else 10
-        books = Book.query.paginate(page=page, per_page=limit, error_out=False)
+            books = Book.search(q, page=page, per_page=limit)
+        else:
+            books = Book.list_page(page=page, per_page=limit)
         all_books = books.items
-        if len(all_books) == 0:
-            return Response(json.dumps({"Message": "No books found"}), status=404)
+        if len(all_books) == 0 and not q:
+            return json_response({"Message": "No books found"}, status=404)
         total_pages = books.pages
         current_page = books.page
-        return Response(json.dumps({"Books": [book.serialize for book in all_books], "totalPages": total_pages,
-                                    "currentPage": current_page}), status=200)
+        return json_response({"Books": [serialize_book(book) for book in all_books], "totalPages": total_pages,
+                              "currentPage": current_page}, status=200)
+
+    @staticmethod
+    def get_after(after, limit):
+        """Serves the keyset paginated book listing (?after=<cursor>&limit=)"""
+        sort = request.args.get("sort", "id")
+        if sort not in Book.SORT_KEYS:
+            return json_response({"Message": "Invalid sort key"}, status=400)
+        try:
+            books, next_cursor = Book.seek(after=after, limit=limit, sort=sort)
+        except InvalidCursor:
+            return json_response({"Message": "Invalid cursor"}, status=400)
+        response = {"Books": [serialize_book(book) for book in books], "nextCursor": next_cursor}
+        if request.args.get("count") == "true":
+            response["totalBooks"] = Book.query.count()
+        return json_response(response, status=200)
 
 
 class GetBook(Resource):
@@ -34,9 +66,14 @@ class GetBook(Resource):
 
     def get(self, book_id):
         """Function serving get a book api endpoint"""
+        return cached_response(('book', book_id), lambda: self.render(book_id))
+
+    @staticmethod
+    def render(book_id):
+        """Builds the get a book response"""
         if validate_arg(book_id):
             return validate_arg(book_id)
         book = Book.get_book_by_id(id=book_id)
         if not book:
-            return Response(json.dumps({"Message": "Book does not exist"}), status=404)
-        return Response(json.dumps(book.serialize), status=200)
+            return json_response({"Message": "Book does not exist"}, status=404)
+        return json_response(book.serialize, status=200)
@@ -0,0 +1,126 @@
+"""Process-local caches"""
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Response, current_app, request
+
+from api.responses import JSON_MIMETYPE
+from config import Config
+
+
+class TTLCache(object):
+    """Thread safe LRU cache whose entries expire after a time to live"""
+
+    def __init__(self, maxsize=1024, ttl=60):
+        """Init function"""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """Gets a live entry and marks it as recently used"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            value, expires = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Stores an entry, evicting the least recently used ones when full"""
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Invalidates an entry"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return entry[0] if entry else None
+
+    def clear(self):
+        """Invalidates every entry"""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# User records keyed by username, see api.identity
+user_cache = TTLCache(maxsize=Config.IDENTITY_CACHE_SIZE, ttl=Config.IDENTITY_CACHE_TTL)
+
+# Serialized catalog responses keyed by catalog version, see cached_response
+response_cache = TTLCache(maxsize=Config.RESPONSE_CACHE_SIZE, ttl=Config.RESPONSE_CACHE_TTL)
+_catalog_version = 0
+_catalog_changed_at = None
+_version_lock = threading.Lock()
+
+
+def catalog_version():
+    """Gets the version of the book catalog seen by this process"""
+    return _catalog_version
+
+
+def bump_catalog_version():
+    """Marks every cached catalog response stale, call after a committed book change"""
+    global _catalog_version, _catalog_changed_at
+    with _version_lock:
+        _catalog_version += 1
+        _catalog_changed_at = time.monotonic()
+
+
+def catalog_settled(window):
+    """Checks if the catalog last changed more than window seconds ago"""
+    return _catalog_changed_at is None or time.monotonic() - _catalog_changed_at >= window
+
+
+def _entry(built):
+    """Cache entry of a built Response: body, status and ETag"""
+    body = built.get_data()
+    return body, built.status_code, hashlib.sha1(body).hexdigest()
+
+
+def cached_response(key, build):
+    """
+    Serves a response from the cache, calling build for a Response on a miss.
+    The strong ETag is a hash of the body so every worker agrees on it, and
+    a matching If-None-Match is answered with 304 Not Modified.
+
+    A user who just wrote gets a fresh response and it is not stored, an
+    entry may have been built from a replica without the write. Responses
+    read from a replica are only stored once the catalog has not changed
+    for DB_REPLICA_STICKY_SECONDS, the replicas should have it by then.
+    """
+    # api.replicas imports this module
+    from api import replicas
+    config = current_app.config
+    if replicas.reads_own_writes():
+        entry = _entry(build())
+    else:
+        key = (catalog_version(),) + tuple(key)
+        entry = response_cache.get(key)
+        if entry is None:
+            entry = _entry(build())
+            if not replicas.read_replica() or catalog_settled(config['DB_REPLICA_STICKY_SECONDS']):
+                response_cache.set(key, entry, ttl=config.get('RESPONSE_CACHE_TTL'))
+    body, status, etag = entry
+    if status == 200 and request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(body, status=status, mimetype=JSON_MIMETYPE)
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,78 @@
+"""Password hashing on a bounded process pool.
+
+PBKDF2 is CPU bound, running it in a small pool of worker processes keeps
+a burst of logins from pinning every request thread. At most
+PASSWORD_HASH_MAX_PENDING hashes wait on the pool at once, further callers
+block until a slot frees up. PASSWORD_HASH_WORKERS = 0 hashes inline.
+"""
+
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app, has_app_context
+from werkzeug.security import generate_password_hash, check_password_hash, DEFAULT_PBKDF2_ITERATIONS
+
+from config import Config
+
+_pool = None
+_pool_pid = None
+_pending = None
+_lock = threading.Lock()
+
+
+def _config(key):
+    """Reads a hashing setting from the app config, class defaults outside an app"""
+    if has_app_context():
+        return current_app.config.get(key, getattr(Config, key))
+    return getattr(Config, key)
+
+
+def _get_pool():
+    """Gets this process's pool, a forked child starts its own"""
+    global _pool, _pool_pid, _pending
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=_config('PASSWORD_HASH_WORKERS'))
+            _pool_pid = os.getpid()
+            _pending = threading.BoundedSemaphore(_config('PASSWORD_HASH_MAX_PENDING'))
+        return _pool, _pending
+
+
+def _run(func, *args):
+    """Runs func on the pool, or inline when the pool is disabled"""
+    if not _config('PASSWORD_HASH_WORKERS'):
+        return func(*args)
+    pool, pending = _get_pool()
+    with pending:
+        return pool.submit(func, *args).result()
+
+
+def hash_password(password):
+    """Hashes a password with the configured method and salt length"""
+    return _run(generate_password_hash, password,
+                _config('PASSWORD_HASH_METHOD'), _config('PASSWORD_SALT_LENGTH'))
+
+
+def verify_password(pwhash, password):
+    """Checks a password against a stored hash"""
+    return _run(check_password_hash, pwhash, password)
+
+
+def _full_method(method):
+    """Spells out the iterations of a pbkdf2 method like werkzeug does in the hashes it makes"""
+    if not method.startswith('pbkdf2:'):
+        return method
+    hash_name, _, iterations = method[len('pbkdf2:'):].partition(':')
+    try:
+        return 'pbkdf2:{}:{}'.format(hash_name, int(iterations or DEFAULT_PBKDF2_ITERATIONS))
+    except ValueError:
+        return method
+
+
+def needs_rehash(pwhash):
+    """Checks if a stored hash was made with other parameters than configured"""
+    method, _, rest = pwhash.partition('$')
+    salt = rest.partition('$')[0]
+    return (_full_method(method) != _full_method(_config('PASSWORD_HASH_METHOD'))
+            or len(salt) != _config('PASSWORD_SALT_LENGTH'))
@@ -0,0 +1,74 @@
+"""Resolves the user behind the current JWT once per request"""
+
+from flask import current_app, request
+from flask_jwt_extended import get_jwt_identity
+
+from api import db
+from api.cache import user_cache
+from api.models import User
+from api.replicas import on_primary
+from api.serializers import serialize_user
+
+
+class CachedUser(object):
+    """Read only snapshot of a user record, safe to share between requests"""
+    __slots__ = ('id', 'email', 'username', 'first_name', 'last_name', 'is_admin')
+
+    def __init__(self, user):
+        """Init function"""
+        self.id = user.id
+        self.email = user.email
+        self.username = user.username
+        self.first_name = user.first_name
+        self.last_name = user.last_name
+        self.is_admin = bool(user.is_admin)
+
+    @property
+    def serialize(self):
+        """Serializes cached user, same keys as User.serialize"""
+        return serialize_user(self)
+
+    def admin(self):
+        """Checks if user is an admin"""
+        return self.is_admin
+
+    def __repr__(self):
+        return "User: {}".format(self.username)
+
+
+def get_user(username):
+    """Gets a user record from the cache, loading it on a miss"""
+    user = user_cache.get(username)
+    if user is None:
+        # Read from the primary, a lagging replica would keep a stale role cached
+        model = on_primary(User.query).filter_by(username=username).first()
+        if model is None:
+            return None
+        user = CachedUser(model)
+        user_cache.set(username, user, ttl=current_app.config.get('IDENTITY_CACHE_TTL'))
+    return user
+
+
+def current_user():
+    """
+    Gets the user making the request, resolved at most once per request.
+    Kept on the request rather than g, an app context can outlive a request.
+    """
+    if not hasattr(request, 'current_user'):
+        request.current_user = get_user(get_jwt_identity())
+    return request.current_user
+
+
+def is_admin(user):
+    """
+    Checks the role of user on the primary before an admin only write.
+    The cached role can be IDENTITY_CACHE_TTL old, a demotion made
+    through another worker only clears that worker's cache. Admin reads
+    trust the cached role.
+    """
+    if user is None or not user.is_admin:
+        return False
+    admin = on_primary(db.session.query(User.is_admin)).filter_by(id=user.id).scalar()
+    if not admin:
+        user_cache.pop(user.username)
+    return bool(admin)
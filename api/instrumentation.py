@@ -0,0 +1,140 @@
+"""Per-request timing of views and the SQL statements they run.
+
+Every request gets a RequestStats in a thread local, which is much cheaper
+to reach from the engine events than the request proxy. They add the
+time spent in SQL statements to it, and once the response is made the
+request is counted and timed in the metrics under its endpoint. In debug
+mode the query count and SQL time are also sent back as response headers.
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from api.metrics import REQUESTS, REQUEST_LATENCY, REQUEST_DB_TIME
+
+UNMATCHED = 'unmatched'
+_series_cache = {}
+_local = threading.local()
+
+
+class RequestStats(object):
+    """Time taken by a request, and the number and time of its SQL statements"""
+    __slots__ = ('start', 'db_time', 'queries')
+
+    def __init__(self):
+        """Init function"""
+        self.start = time.perf_counter()
+        self.db_time = 0.0
+        self.queries = 0
+
+
+def current_stats():
+    """Gets the stats of the request being served, None outside a request"""
+    return getattr(_local, 'stats', None)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    """Remembers when a statement was sent"""
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    """Adds a statement to the current request"""
+    _statement_done(conn, statement)
+
+
+@event.listens_for(Engine, 'handle_error')
+def _execute_failed(context):
+    """Adds a failed statement too, after_cursor_execute is skipped for it"""
+    if context.connection is not None and context.connection.info.get('query_start'):
+        _statement_done(context.connection, context.statement)
+
+
+def _statement_done(conn, statement):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    stats = current_stats()
+    if stats is not None:
+        stats.db_time += elapsed
+        stats.queries += 1
+    for statements in getattr(_local, 'counters', ()):
+        statements.append(statement)
+
+
+@contextmanager
+def count_queries():
+    """Collects the SQL statements run by this thread inside the block"""
+    statements = []
+    counters = _local.__dict__.setdefault('counters', [])
+    counters.append(statements)
+    try:
+        yield statements
+    finally:
+        counters.remove(statements)
+
+
+def _start_request():
+    _local.stats = RequestStats()
+
+
+def _series(endpoint, method, status):
+    """Gets the metric children of a label set, labels() takes a lock on every call"""
+    key = (endpoint, method, status)
+    series = _series_cache.get(key)
+    if series is None:
+        series = _series_cache[key] = (
+            REQUESTS.labels(endpoint, method, str(status)),
+            REQUEST_LATENCY.labels(endpoint, method),
+            REQUEST_DB_TIME.labels(endpoint, method),
+        )
+    return series
+
+
+def _record(status):
+    """Counts and times the current request"""
+    stats = current_stats()
+    if stats is None:
+        return
+    elapsed = time.perf_counter() - stats.start
+    _local.stats = None
+    current = request._get_current_object()
+    requests, latency, db_time = _series(current.endpoint or UNMATCHED, current.method, status)
+    requests.inc()
+    latency.observe(elapsed)
+    db_time.observe(stats.db_time)
+
+
+def _finish_request(response):
+    _record(response.status_code)
+    return response
+
+
+def _debug_headers(response):
+    stats = current_stats()
+    if stats is not None:
+        response.headers['X-Query-Count'] = str(stats.queries)
+        response.headers['Server-Timing'] = 'db;desc="{} queries";dur={:.2f}'.format(
+            stats.queries, stats.db_time * 1000)
+    return response
+
+
+def _teardown_request(error=None):
+    # Only still pending when an unhandled error skipped after_request
+    if error is not None:
+        _record(500)
+
+
+def init_app(app):
+    """Records metrics for every request served by app"""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_teardown_request)
+    if app.debug:
+        # after_request hooks run last registered first, so before the stats are recorded
+        app.after_request(_debug_headers)
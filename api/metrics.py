@@ -0,0 +1,66 @@
+"""Prometheus metrics, served at /metrics.
+
+Under gunicorn set PROMETHEUS_MULTIPROC_DIR to an empty directory shared
+by the workers before starting it. Every worker then writes its samples
+there and a scrape of any worker reports all of them.
+"""
+
+import os
+
+from flask import Blueprint, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
+
+MULTIPROC_ENV = ('PROMETHEUS_MULTIPROC_DIR', 'prometheus_multiproc_dir')
+
+mod = Blueprint('metrics', __name__)
+
+REQUESTS = Counter(
+    'http_requests_total', 'Requests served', ['endpoint', 'method', 'status'])
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Time taken to build a response', ['endpoint', 'method'])
+REQUEST_DB_TIME = Histogram(
+    'http_request_db_seconds', 'Time a request spent in SQL statements', ['endpoint', 'method'],
+    buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+
+POOL_CHECKOUT_WAIT = Histogram(
+    'db_pool_checkout_wait_seconds', 'Time spent getting a connection from the pool', ['pool'],
+    buckets=(.0005, .001, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+POOL_IN_USE = Gauge(
+    'db_pool_connections_in_use', 'Connections checked out of the pool', ['pool'],
+    multiprocess_mode='livesum')
+POOL_OVERFLOW = Counter(
+    'db_pool_overflow_total', 'Connections opened beyond the pool size', ['pool'])
+POOL_TIMEOUTS = Counter(
+    'db_pool_checkout_timeouts_total', 'Checkouts that gave up waiting for a connection', ['pool'])
+REPLICA_UP = Gauge(
+    'db_replica_up', 'Whether reads are routed to a replica, per worker', ['replica'],
+    multiprocess_mode='liveall')
+
+
+def multiprocess_mode():
+    """Checks if samples are shared between worker processes"""
+    return any(name in os.environ for name in MULTIPROC_ENV)
+
+
+def registry():
+    """Gets the registry to scrape, aggregated over workers in multiprocess mode"""
+    if not multiprocess_mode():
+        return REGISTRY
+    aggregated = CollectorRegistry()
+    multiprocess.MultiProcessCollector(aggregated)
+    return aggregated
+
+
+def mark_process_dead(pid):
+    """Drops the live gauges of an exited worker, call it from gunicorn's child_exit"""
+    if multiprocess_mode():
+        multiprocess.mark_process_dead(pid)
+
+
+@mod.route('/metrics')
+def metrics():
+    """Renders every metric in the Prometheus text format"""
+    return Response(generate_latest(registry()), content_type=CONTENT_TYPE_LATEST)
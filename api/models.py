@@ -1,10 +1,23 @@
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timedelta
 from dataclasses import dataclass
 from api import db
+from api import search
+from api import pagination
+from api import hashing
+from api.cache import user_cache, bump_catalog_version
+from api.replicas import on_primary
+from api.serializers import serialize_book, serialize_user
 from sqlalchemy import or_
 
 
+class BatchConflict(RuntimeError):
+    """Raised when a batch checkout or return kept conflicting with concurrent ones"""
+
+
+class LastAdmin(ValueError):
+    """Raised when a change of roles would leave no admin"""
+
+
 @dataclass
 class User(db.Model):
     """User Model"""
@@ -35,17 +48,22 @@ class User(db.Model):
 
     @password.setter
     def password(self, password):
-        self.secure_password = generate_password_hash(password)
+        self.secure_password = User.hash_password(password)
 
     @staticmethod
     def hash_password(password1):
-        """Hashes user password"""
-        return generate_password_hash(password1)
+        """Hashes user password off the request thread"""
+        return hashing.hash_password(password1)
 
     @staticmethod
     def verify_password(saved_password, password1):
         """Check is password hash matches actual password"""
-        return check_password_hash(saved_password, password1)
+        return hashing.verify_password(saved_password, password1)
+
+    @staticmethod
+    def needs_rehash(saved_password):
+        """Checks if the password hash was made with outdated cost settings"""
+        return hashing.needs_rehash(saved_password)
 
     def save(self):
         """Saves user objects to database"""
@@ -57,6 +75,55 @@ class User(db.Model):
         """Gets all users"""
         return User.query.all()
 
+    @staticmethod
+    def select_rows(admin=None, joined_from=None, joined_to=None, name=None):
+        """
+        Core select of the serialized user columns (and id), no ORM objects are built.
+        Filters by admin flag, joined date range and a username, first or last name prefix.
+        """
+        columns = User.__table__.c
+        statement = db.select(
+            columns.id, columns.email, columns.username, columns.first_name, columns.last_name, columns.is_admin)
+        if admin is not None:
+            statement = statement.where(columns.is_admin == admin)
+        if joined_from:
+            statement = statement.where(columns.joined >= joined_from)
+        if joined_to:
+            statement = statement.where(columns.joined <= joined_to)
+        if name:
+            prefix = pagination.like_prefix(name)
+            statement = statement.where(or_(
+                columns.username.ilike(prefix, escape='\\'), columns.first_name.ilike(prefix, escape='\\'),
+                columns.last_name.ilike(prefix, escape='\\')))
+        return statement
+
+    @staticmethod
+    def stream_rows(**filters):
+        """Yields the filtered user rows in id order from a server-side cursor"""
+        return pagination.stream_rows(User.select_rows(**filters).order_by(User.__table__.c.id))
+
+    @staticmethod
+    def seek(after=None, limit=50, **filters):
+        """Gets the page of filtered user rows after a cursor, in id order"""
+        columns = User.__table__.c
+        return pagination.seek(User.select_rows(**filters), 'id', columns.id, columns.id, after=after, limit=limit)
+
+    @staticmethod
+    def taken_fields(email, username):
+        """
+        Checks in one indexed query whether email or username are taken.
+        Returns the set of taken field names.
+        """
+        rows = db.session.query(User.email, User.username).filter(
+            or_(User.email == email, User.username == username)).limit(2).all()
+        taken = set()
+        for row in rows:
+            if row.email == email:
+                taken.add('email')
+            if row.username == username:
+                taken.add('username')
+        return taken
+
     @staticmethod
     def get_user_by_username(username):
         """Gets user by username"""
@@ -66,31 +133,52 @@ class User(db.Model):
         """Updates user's password"""
         self.secure_password = User.hash_password(password)
         User.save(self)
+        user_cache.pop(self.username)
 
     @property
     def serialize(self):
         """Serializes User object"""
-        return {
-            "email": self.email,
-            "username": self.username,
-            "firstName": self.first_name,
-            "lastName": self.last_name,
-            "is_admin": self.is_admin,
-        }
+        return serialize_user(self)
 
     @property
     def promote(self):
         """Promotes normal user to admin"""
         self.is_admin = True
         User.save(self)
+        user_cache.pop(self.username)
         return f'User: {self.username} is now an admin'
 
     @staticmethod
     def promote_user(username):
-        """Promotes normal user to admin in tests"""
-        user = User.get_user_by_username(username)
-        user.is_admin = True
-        user.save()
+        """Promotes normal user to admin, returns False if there is no such user"""
+        return not User.set_admin([username])
+
+    @staticmethod
+    def set_admin(usernames, is_admin=True):
+        """
+        Grants or revokes admin of every named user with a single UPDATE.
+        Returns the names that matched no user, raises LastAdmin
+        rather than demote every admin.
+        """
+        usernames = set(usernames)
+        found = set(db.session.execute(
+            db.select(User.username).where(User.username.in_(usernames))).scalars())
+        if found and not is_admin:
+            # Locking the admins makes concurrent demotions wait for each other
+            admins = set(db.session.execute(
+                db.select(User.username).where(User.is_admin.is_(True))
+                .order_by(User.id).with_for_update()).scalars())
+            if not admins - found:
+                db.session.rollback()
+                raise LastAdmin("At least one admin must remain")
+        if found:
+            db.session.execute(
+                db.update(User).where(User.username.in_(found))
+                .values(is_admin=is_admin).execution_options(synchronize_session=False))
+            db.session.commit()
+            for username in found:
+                user_cache.pop(username)
+        return sorted(usernames - found)
 
     def admin(self):
         """Checks if user is an admin"""
@@ -105,13 +193,19 @@ class Book(db.Model):
     """Book Model"""
     # Ensure table name is in plural
     __tablename__ = 'books'
+    __table_args__ = (
+        # Seek indexes for keyset pagination of the book listing
+        db.Index('ix_books_title_id', 'title', 'id'),
+        db.Index('ix_books_author_id', 'author', 'id'),
+    )
+    SORT_KEYS = ('id', 'title', 'author')
+    LISTED_COLUMNS = ('id', 'title', 'author', 'isbn', 'publisher', 'quantity')
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(500), index=True)
     author = db.Column(db.String(100), index=True)
     isbn = db.Column(db.String(100), index=True, unique=True)
     publisher = db.Column(db.String(100), index=True)
     quantity = db.Column(db.Integer)
-    availability = False
     created = db.Column(db.Date, default=datetime.today())
     reviewers = db.relationship(
         'User', secondary='reviewed_books', lazy='dynamic')
@@ -134,41 +228,62 @@ class Book(db.Model):
         return Book.query.filter_by(id=id).first()
 
     @staticmethod
-    def search(q):
-        books = Book.query.filter_by(title=q).all()
-        return {"Books": [book.serialize for book in books]}
+    def select_rows():
+        """Core select of the book columns listings serialize, no ORM objects are built"""
+        return db.select(*[Book.__table__.c[name] for name in Book.LISTED_COLUMNS])
+
+    @staticmethod
+    def list_page(page=1, per_page=10):
+        """Gets a page of book rows ordered by id"""
+        return pagination.paginate_rows(
+            Book.select_rows().order_by(Book.__table__.c.id), page=page, per_page=per_page)
+
+    @staticmethod
+    def seek(after=None, limit=10, sort='id'):
+        """Gets the page of book rows after a cursor, ordered by sort key then id"""
+        columns = Book.__table__.c
+        return pagination.seek(Book.select_rows(), sort, columns[sort], columns.id, after=after, limit=limit)
+
+    @staticmethod
+    def search(q, page=1, per_page=10):
+        """Ranked full-text search over title, author and publisher"""
+        return search.search(Book, q, page=page, per_page=per_page)
 
     @property
     def serialize(self):
         """Serializes book information"""
-        self.availability = self.quantity != 0
-        return {
-            "id": self.id,
-            "title": self.title,
-            "author": self.author,
-            "isbn": self.isbn,
-            "publisher": self.publisher,
-            "availability": self.availability,
-            "quantity": self.quantity
-        }
+        return serialize_book(self)
 
     def save(self):
         """Saves book object to database"""
         db.session.add(self)
         db.session.commit()
+        bump_catalog_version()
 
     def delete(self):
         """Deletes book object"""
         db.session.delete(self)
         db.session.commit()
+        bump_catalog_version()
 
     def __repr__(self):
         return "Book: {}".format(self.title)
 
 
+search.register_search_ddl(Book.__table__)
+
+
 class ReviewBook(db.Model):
     """Association Table"""
     __tablename__ = "reviewed_books"
+    __table_args__ = (
+        db.Index('ix_reviewed_books_user_id_date_reviewed', 'user_id', 'date_reviewed'),
+        db.Index('ix_reviewed_books_user_id_reviewed', 'user_id', 'reviewed'),
+        # Partial index over outstanding reviews only, ordered by due date
+        db.Index('ix_reviewed_books_outstanding_due', 'date_of_review',
+                 postgresql_where=db.text('reviewed = false'),
+                 sqlite_where=db.text('reviewed = 0')),
+    )
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     book_id = db.Column(db.Integer, db.ForeignKey('books.id'))
@@ -184,56 +299,187 @@ class ReviewBook(db.Model):
         return ReviewBook.query.all()
 
     @staticmethod
-    def get_user_review_history(user_id):
-        """ Gets user review history"""
-        reviewed_books = ReviewBook.get_all_reviewed_books()
-        user_books = [
-            book for book in reviewed_books if book.user_id == user_id]
-        review_history = []
-        book_details = {}
-        for book in user_books:
-            try:
-                single_book = Book.get_book_by_id(book.book_id)
-                book_details["id"] = single_book.id
-                book_details["title"] = single_book.title
-                book_details["author"] = single_book.author
-                book_details["isbn"] = single_book.isbn
-                book_details["review_date"] = book.date_reviewed
-                if book.reviewed:
-                    book_details["reviewed_date"] = book.date_reviewed
-                else:
-                    book_details["review_date"] = book.date_of_review
-            except Exception as e:
-                print(e)
-            finally:
-                review_history.append(book_details)
-                book_details = {}
-        return review_history
+    def get_user_review_history(user_id, start=None, end=None, page=None, per_page=None):
+        """
+        Gets user review history in one query joined to books.
+        Rows are yielded lazily in batches so long histories can be streamed.
+        """
+        books, reviews = Book.__table__.c, ReviewBook.__table__.c
+        statement = db.select(
+            books.id, books.title, books.author, books.isbn,
+            reviews.date_reviewed, reviews.date_of_review, reviews.reviewed
+        ).join_from(ReviewBook.__table__, Book.__table__, books.id == reviews.book_id).where(
+            reviews.user_id == user_id)
+        if start:
+            statement = statement.where(reviews.date_reviewed >= start)
+        if end:
+            statement = statement.where(reviews.date_reviewed <= end)
+        statement = statement.order_by(reviews.id)
+        if per_page:
+            statement = statement.limit(per_page).offset(((page or 1) - 1) * per_page)
+        result = db.session.execute(statement.execution_options(stream_results=True))
+        for row in result.yield_per(500):
+            book_details = {
+                "id": row.id,
+                "title": row.title,
+                "author": row.author,
+                "isbn": row.isbn,
+                "review_date": row.date_reviewed,
+            }
+            if row.reviewed:
+                book_details["reviewed_date"] = row.date_reviewed
+            else:
+                book_details["review_date"] = row.date_of_review
+            yield book_details
+
+    @staticmethod
+    def outstanding_query():
+        """Query over reviews not done yet, joined to their books"""
+        return db.session.query(
+            ReviewBook.id.label('review_id'), ReviewBook.user_id,
+            Book.id, Book.title, Book.author, Book.isbn,
+            ReviewBook.date_reviewed, ReviewBook.date_of_review
+        ).join(Book, Book.id == ReviewBook.book_id).filter(ReviewBook.reviewed == False)
 
     @staticmethod
     def get_books_not_reviewed(user_id):
         """Gets books not reviewed by user"""
-        reviewed_books = ReviewBook.get_all_reviewed_books()
-        # User non reviewed books
-        user_books = [book for book in reviewed_books if book.user_id ==
-                      user_id and book.returned == False]
-        unreviewed_books = []
-        book_details = {}
-        for book in user_books:
-            try:
-                single_book = Book.get_book_by_id(book.book_id)
-                book_details["id"] = single_book.id
-                book_details["title"] = single_book.title
-                book_details["author"] = single_book.author
-                book_details["isbn"] = single_book.isbn
-                book_details["reviewDate"] = book.date_reviewed
-                book_details["dueDate"] = book.date_due
-            except Exception as e:
-                print(f'error {e}')
-            finally:
-                unreviewed_books.append(book_details)
-                book_details = {}
-        return unreviewed_books
+        query = ReviewBook.outstanding_query().filter(
+            ReviewBook.user_id == user_id).order_by(ReviewBook.id)
+        return [{
+            "id": row.id,
+            "title": row.title,
+            "author": row.author,
+            "isbn": row.isbn,
+            "reviewDate": row.date_reviewed,
+            "dueDate": row.date_of_review,
+        } for row in query]
+
+    @staticmethod
+    def get_all_outstanding(page=1, per_page=50, due_before=None):
+        """Paginates outstanding reviews of all users, earliest due date first"""
+        query = ReviewBook.outstanding_query().add_columns(
+            User.username, User.email).join(User, User.id == ReviewBook.user_id)
+        if due_before:
+            query = query.filter(ReviewBook.date_of_review <= due_before)
+        query = query.order_by(ReviewBook.date_of_review, ReviewBook.id)
+        return query.paginate(page=page, per_page=per_page, error_out=False)
+
+    @staticmethod
+    def checkout(user_id, book_id):
+        """
+        Takes one copy of a book for review in a single transaction.
+        The decrement only applies while copies are left, returns False if none were.
+        """
+        taken = db.session.execute(
+            db.update(Book).where(Book.id == book_id, Book.quantity > 0)
+            .values(quantity=Book.quantity - 1).execution_options(synchronize_session=False))
+        if taken.rowcount != 1:
+            db.session.rollback()
+            return False
+        db.session.add(ReviewBook(user_id=user_id, book_id=book_id))
+        db.session.commit()
+        bump_catalog_version()
+        return True
+
+    def check_in(self):
+        """
+        Marks the review done and puts the copy back, in one transaction.
+        Only the return that flips reviewed adds the copy, returns False if it was already returned.
+        """
+        returned = db.session.execute(
+            db.update(ReviewBook).where(ReviewBook.id == self.id, ReviewBook.reviewed == False)
+            .values(reviewed=True, date_reviewed=datetime.now()).execution_options(synchronize_session=False))
+        if returned.rowcount != 1:
+            db.session.rollback()
+            return False
+        db.session.execute(
+            db.update(Book).where(Book.id == self.book_id)
+            .values(quantity=Book.quantity + 1).execution_options(synchronize_session=False))
+        db.session.commit()
+        bump_catalog_version()
+        return True
+
+    @staticmethod
+    def checkout_many(user_id, book_ids, retries=3):
+        """
+        Takes one copy of each book for review in one transaction.
+        Returns (book id, outcome) pairs in request order, outcome is one of
+        "checked_out", "not_found", "already_reviewing" or "unavailable".
+        """
+        book_ids = list(dict.fromkeys(book_ids))
+        for _ in range(retries):
+            quantities = dict(db.session.execute(
+                db.select(Book.id, Book.quantity).where(Book.id.in_(book_ids)).order_by(Book.id).with_for_update()).all())
+            reviewing = set(db.session.execute(
+                db.select(ReviewBook.book_id).where(
+                    ReviewBook.user_id == user_id, ReviewBook.reviewed == False,
+                    ReviewBook.book_id.in_(book_ids))).scalars())
+            outcomes = []
+            for book_id in book_ids:
+                if book_id not in quantities:
+                    outcomes.append((book_id, "not_found"))
+                elif book_id in reviewing:
+                    outcomes.append((book_id, "already_reviewing"))
+                elif quantities[book_id] <= 0:
+                    outcomes.append((book_id, "unavailable"))
+                else:
+                    outcomes.append((book_id, "checked_out"))
+            taken = [book_id for book_id, outcome in outcomes if outcome == "checked_out"]
+            if not taken:
+                db.session.rollback()
+                return outcomes
+            updated = db.session.execute(
+                db.update(Book).where(Book.id.in_(taken), Book.quantity > 0)
+                .values(quantity=Book.quantity - 1).execution_options(synchronize_session=False))
+            if updated.rowcount != len(taken):
+                # Another checkout took the last copy since the read, read again
+                db.session.rollback()
+                continue
+            db.session.execute(ReviewBook.__table__.insert(), [
+                {"user_id": user_id, "book_id": book_id} for book_id in taken])
+            db.session.commit()
+            bump_catalog_version()
+            return outcomes
+        raise BatchConflict("Batch checkout kept conflicting with other checkouts")
+
+    @staticmethod
+    def check_in_many(user_id, book_ids, retries=3):
+        """
+        Finishes the user's reviews of the books and puts the copies back, in one transaction.
+        Returns (book id, outcome) pairs in request order, outcome is one of
+        "returned", "not_found" or "not_reviewing".
+        """
+        book_ids = list(dict.fromkeys(book_ids))
+        for _ in range(retries):
+            found = set(db.session.execute(
+                db.select(Book.id).where(Book.id.in_(book_ids))).scalars())
+            reviews = {}
+            for review_id, book_id in db.session.execute(
+                    db.select(ReviewBook.id, ReviewBook.book_id).where(
+                        ReviewBook.user_id == user_id, ReviewBook.reviewed == False,
+                        ReviewBook.book_id.in_(book_ids)).order_by(ReviewBook.id).with_for_update()):
+                reviews.setdefault(book_id, review_id)
+            outcomes = [(book_id, "returned" if book_id in reviews else
+                         "not_found" if book_id not in found else "not_reviewing")
+                        for book_id in book_ids]
+            if not reviews:
+                db.session.rollback()
+                return outcomes
+            updated = db.session.execute(
+                db.update(ReviewBook).where(ReviewBook.id.in_(list(reviews.values())), ReviewBook.reviewed == False)
+                .values(reviewed=True, date_reviewed=datetime.now()).execution_options(synchronize_session=False))
+            if updated.rowcount != len(reviews):
+                # Another return finished one of the reviews since the read, read again
+                db.session.rollback()
+                continue
+            db.session.execute(
+                db.update(Book).where(Book.id.in_(list(reviews)))
+                .values(quantity=Book.quantity + 1).execution_options(synchronize_session=False))
+            db.session.commit()
+            bump_catalog_version()
+            return outcomes
+        raise BatchConflict("Batch return kept conflicting with other returns")
 
     def save(self):
         """Saved book reviewed to database"""
@@ -241,31 +487,63 @@ class ReviewBook(db.Model):
         db.session.commit()
 
 
+def prune_expired(model, batch_size=1000, now=None):
+    """
+    Deletes rows of a model whose expires_at has passed, batch_size rows per
+    statement so the delete never holds long locks. Returns rows deleted.
+    """
+    now = now or datetime.utcnow()
+    deleted = 0
+    while True:
+        ids = [id for id, in db.session.query(model.id).filter(
+            model.expires_at < now).limit(batch_size)]
+        if not ids:
+            return deleted
+        model.query.filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.session.commit()
+        deleted += len(ids)
+        if len(ids) < batch_size:
+            return deleted
+
+
 @dataclass
 class Token(db.Model):
     """Token Model"""
     __tablename__ = 'tokens'
 
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String(1000), index=True, unique=True)
+    jti = db.Column(db.String(36), index=True, unique=True)
     owner = db.Column(db.String(60))
-    created = db.Column(db.DateTime, default=datetime.today())
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True)
 
-    def __init__(self, token, owner):
+    def __init__(self, jti, owner, expires_at):
         """Init function"""
-        self.token = token
+        self.jti = jti
         self.owner = owner
+        self.expires_at = expires_at
 
 
     @staticmethod
     def all_tokens():
         """Gets all tokens"""
-        return Token.query.all()
+        return on_primary(Token.query).all()
 
     @staticmethod
     def token_by_owner(username):
         """Gets token by user's username"""
-        return Token.query.filter_by(owner=username).first()
+        return on_primary(Token.query).filter_by(owner=username).first()
+
+    @staticmethod
+    def delete_by_jti(jti):
+        """Deletes the token with the given id"""
+        Token.query.filter_by(jti=jti).delete(synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def prune_expired(batch_size=1000):
+        """Deletes expired tokens in batches"""
+        return prune_expired(Token, batch_size=batch_size)
 
     def save(self):
         """Saves generated token to database."""
@@ -284,17 +562,24 @@ class Revoked(db.Model):
 
     __tablename__ = 'revoked'
     id = db.Column(db.Integer, primary_key=True)
-    token = db.Column(db.String(1000), index=True)
-    date_revoked = db.Column(db.DateTime, default=datetime.now())
+    jti = db.Column(db.String(36), index=True, unique=True)
+    date_revoked = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, index=True)
 
-    def __init__(self, token):
+    def __init__(self, jti, expires_at):
         """Init function"""
-        self.token = token
+        self.jti = jti
+        self.expires_at = expires_at
 
     @staticmethod
-    def is_blacklisted(token):
+    def is_blacklisted(jti):
         """Checks if token is revoked"""
-        return bool(Revoked.query.filter_by(token=token).first())
+        return bool(on_primary(Revoked.query).filter_by(jti=jti).first())
+
+    @staticmethod
+    def prune_expired(batch_size=1000):
+        """Deletes revocations of tokens that have expired anyway, in batches"""
+        return prune_expired(Revoked, batch_size=batch_size)
 
     def save(self):
         """Saves revoked token to database"""
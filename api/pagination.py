@@ -0,0 +1,101 @@
+"""Keyset (cursor) pagination helpers.
+
+A cursor is an opaque token holding the sort key and id of the last row
+on a page, the next page seeks past it on an index over (sort key, id)
+instead of counting and skipping rows with OFFSET.
+"""
+
+import base64
+import json
+
+from flask_sqlalchemy import Pagination
+from sqlalchemy import func, select, tuple_
+
+from api import db
+
+
+class InvalidCursor(ValueError):
+    """Raised when a cursor token cannot be decoded"""
+
+
+def encode_cursor(sort, value, id):
+    """Packs the position after a row into an opaque token"""
+    raw = json.dumps([sort, value, id], separators=(',', ':'), default=str)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token, sort):
+    """Unpacks a cursor token, it must have been issued for the same sort"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        cursor_sort, value, id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        raise InvalidCursor(token)
+    if cursor_sort != sort or not isinstance(id, int):
+        raise InvalidCursor(token)
+    return value, id
+
+
+def positive_arg(value, default, maximum=None):
+    """Parses a page or page size argument, raises ValueError unless it is 1 to maximum"""
+    number = int(value) if value else default
+    if number < 1 or (maximum is not None and number > maximum):
+        raise ValueError(number)
+    return number
+
+
+def seek(statement, sort, sort_column, id_column, after=None, limit=10):
+    """
+    Returns (rows, next cursor) for the page of a select following the after cursor.
+    Fetches one extra row to find out if there is a next page.
+    """
+    if limit < 1:
+        raise ValueError("limit must be at least 1")
+    if after:
+        value, id = decode_cursor(after, sort)
+        if sort_column is id_column:
+            statement = statement.where(id_column > id)
+        else:
+            statement = statement.where(tuple_(sort_column, id_column) > tuple_(value, id))
+    if sort_column is id_column:
+        statement = statement.order_by(id_column)
+    else:
+        statement = statement.order_by(sort_column, id_column)
+    rows = db.session.execute(statement.limit(limit + 1)).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(sort, getattr(last, sort_column.key), getattr(last, id_column.key))
+
+
+def stream_rows(statement, batch_size=500):
+    """Yields the rows of a select from a server-side cursor, batch_size rows at a time"""
+    result = db.session.execute(statement.execution_options(stream_results=True))
+    yield from result.yield_per(batch_size)
+
+
+def like_prefix(text):
+    """LIKE pattern matching values that start with text, wildcards in it match literally"""
+    return text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+
+
+def count_rows(statement):
+    """Counts the rows a select would return"""
+    return db.session.execute(
+        select(func.count()).select_from(statement.order_by(None).subquery())).scalar()
+
+
+def paginate_rows(statement, page=1, per_page=10):
+    """
+    Pages a select like Query.paginate, but returns plain rows.
+    The count is skipped when the first page is not full.
+    """
+    page = max(page, 1)
+    per_page = per_page if per_page >= 0 else 20
+    rows = db.session.execute(statement.limit(per_page).offset((page - 1) * per_page)).all()
+    if page == 1 and len(rows) < per_page:
+        total = len(rows)
+    else:
+        total = count_rows(statement)
+    return Pagination(None, page, per_page, total, rows)
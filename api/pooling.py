@@ -0,0 +1,59 @@
+"""Database connection pool settings and instrumentation.
+
+Server databases get a metered QueuePool sized by the DB_* settings of the
+config. SQLite keeps the pools Flask-SQLAlchemy picks for it.
+"""
+
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool
+
+from api.metrics import POOL_CHECKOUT_WAIT, POOL_IN_USE, POOL_OVERFLOW, POOL_TIMEOUTS
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool recording checkout waits, connections in use, overflow and timeouts"""
+
+    @property
+    def metric_name(self):
+        """Label of this pool's metrics, the engine's pool_logging_name"""
+        return self.logging_name or 'default'
+
+    def _do_get(self):
+        overflow = self._overflow
+        start = time.perf_counter()
+        try:
+            record = super()._do_get()
+        except exc.TimeoutError:
+            POOL_TIMEOUTS.labels(self.metric_name).inc()
+            raise
+        finally:
+            POOL_CHECKOUT_WAIT.labels(self.metric_name).observe(time.perf_counter() - start)
+        if self._overflow > max(overflow, 0):
+            POOL_OVERFLOW.labels(self.metric_name).inc()
+        POOL_IN_USE.labels(self.metric_name).inc()
+        return record
+
+    def _do_return_conn(self, conn):
+        POOL_IN_USE.labels(self.metric_name).dec()
+        super()._do_return_conn(conn)
+
+
+def engine_options(config, uri=None, name='primary'):
+    """Builds create_engine options for uri (the config's database by default)"""
+    uri = uri or config.get('SQLALCHEMY_DATABASE_URI') or ''
+    options = {'pool_pre_ping': config['DB_POOL_PRE_PING'], 'pool_logging_name': name}
+    if uri.startswith('sqlite'):
+        return options
+    options.update(
+        poolclass=MeteredQueuePool,
+        pool_size=config['DB_POOL_SIZE'],
+        max_overflow=config['DB_MAX_OVERFLOW'],
+        pool_timeout=config['DB_POOL_TIMEOUT'],
+        pool_recycle=config['DB_POOL_RECYCLE'],
+    )
+    if config['DB_STATEMENT_TIMEOUT'] and uri.startswith('postgres'):
+        options['connect_args'] = {
+            'options': '-c statement_timeout={}'.format(config['DB_STATEMENT_TIMEOUT'])}
+    return options
@@ -0,0 +1,36 @@
+"""Deletes expired login tokens and revocations"""
+
+import threading
+
+from api.models import Token, Revoked
+
+
+def prune_tokens(batch_size=1000):
+    """Prunes expired rows from the tokens and revoked tables"""
+    return {
+        "tokens": Token.prune_expired(batch_size=batch_size),
+        "revoked": Revoked.prune_expired(batch_size=batch_size),
+    }
+
+
+def start_pruner(app, interval=None):
+    """
+    Prunes expired tokens every interval seconds on a daemon thread.
+    Does nothing when the interval (TOKEN_PRUNE_INTERVAL by default) is 0.
+    """
+    interval = app.config['TOKEN_PRUNE_INTERVAL'] if interval is None else interval
+    if not interval:
+        return None
+    stopped = threading.Event()
+
+    def run():
+        while not stopped.wait(interval):
+            with app.app_context():
+                try:
+                    prune_tokens(app.config['TOKEN_PRUNE_BATCH_SIZE'])
+                except Exception as e:
+                    app.logger.warning('Pruning expired tokens failed: %s', e)
+
+    thread = threading.Thread(target=run, name='token-pruner', daemon=True)
+    thread.start()
+    return stopped
@@ -0,0 +1,265 @@
+"""Read replica routing.
+
+Sessions are RoutingSessions: during a GET, HEAD or OPTIONS request a plain
+SELECT goes to one of the DB_REPLICA_URLS, picked round-robin once per
+request, and everything else goes to the primary. Once a request writes,
+the rest of its statements stay on the primary.
+
+A request that wrote keeps its user's reads on the primary for
+DB_REPLICA_STICKY_SECONDS, so they read their own writes while the
+replicas catch up. It is remembered per JWT identity in this process and
+in a cookie, which other workers honour too.
+
+A replica is left out for DB_REPLICA_CHECK_INTERVAL seconds once
+connecting to it fails, and the read that found it down is run again on
+the primary. With start_replica_checks every replica is also
+probed on a daemon thread, and Postgres replicas more than
+DB_REPLICA_MAX_LAG seconds behind are left out until they catch up.
+Reads fall back to the primary when no replica is usable.
+"""
+
+import itertools
+import math
+import threading
+import time
+
+from flask import current_app, has_request_context, request
+from flask_jwt_extended import get_jwt_identity
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, event, exc, orm, text
+from sqlalchemy.sql.dml import UpdateBase
+from sqlalchemy.sql.selectable import GenerativeSelect
+
+from api.cache import TTLCache
+from api.metrics import REPLICA_UP
+from api.pooling import engine_options
+
+READ_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS'))
+STICKY_COOKIE = 'read_primary_until'
+# Statement execution option sending a read to the primary whatever the request
+PRIMARY_OPTION = 'use_primary'
+# Seconds a Postgres replica is behind, 0 when it has replayed all it received
+LAG_QUERIES = {
+    'postgresql': "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                  "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END",
+}
+
+# JWT identities that wrote recently, see remember_writes
+recent_writers = TTLCache(maxsize=10000)
+_build_lock = threading.Lock()
+
+
+class Replica(object):
+    """A replica engine, left out of the rotation for a while after it fails"""
+
+    def __init__(self, name, engine, retry_after):
+        """Init function"""
+        self.name = name
+        self.engine = engine
+        self.retry_after = retry_after
+        self.down_until = 0.0
+        event.listen(engine, 'handle_error', self._failed)
+
+    @property
+    def healthy(self):
+        """Checks if reads may be sent to this replica"""
+        return self.down_until <= time.monotonic()
+
+    def mark(self, healthy):
+        """Puts the replica back in the rotation or leaves it out for retry_after seconds"""
+        self.down_until = 0.0 if healthy else time.monotonic() + self.retry_after
+        REPLICA_UP.labels(self.name).set(1 if healthy else 0)
+
+    def lag(self):
+        """Seconds the replica is behind the primary, raises if it can't be reached"""
+        query = text(LAG_QUERIES.get(self.engine.dialect.name, 'SELECT 0'))
+        with self.engine.connect() as conn:
+            return float(conn.execute(query).scalar() or 0)
+
+    def _failed(self, context):
+        # No connection means connecting failed
+        if context.connection is None or context.is_disconnect:
+            self.mark(False)
+
+
+class ReplicaSet(object):
+    """The configured replicas, handed out round-robin"""
+
+    def __init__(self, replicas):
+        """Init function"""
+        self.replicas = replicas
+        self._turns = itertools.count()
+
+    @classmethod
+    def from_config(cls, config):
+        """Builds an engine per DB_REPLICA_URLS entry with the pool settings of the config"""
+        retry_after = config['DB_REPLICA_CHECK_INTERVAL'] or 5
+        replicas = []
+        for n, url in enumerate(config['DB_REPLICA_URLS']):
+            name = 'replica{}'.format(n)
+            replicas.append(Replica(name, create_engine(url, **engine_options(config, url, name)), retry_after))
+        return cls(replicas)
+
+    def choose(self):
+        """Next healthy replica, None when there is none"""
+        count = len(self.replicas)
+        start = next(self._turns)
+        for offset in range(count):
+            replica = self.replicas[(start + offset) % count]
+            if replica.healthy:
+                return replica
+        return None
+
+    def check(self, max_lag, logger=None):
+        """Probes every replica, leaving out the unreachable ones and those lagging over max_lag seconds"""
+        for replica in self.replicas:
+            try:
+                lag = replica.lag()
+            except exc.SQLAlchemyError as e:
+                lag = None
+                if logger:
+                    logger.warning('Replica %s is unreachable: %s', replica.name, e)
+            replica.mark(lag is not None and lag <= max_lag)
+
+    def dispose(self):
+        """Drops every replica connection"""
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+    def __len__(self):
+        return len(self.replicas)
+
+
+def replica_set(app):
+    """Gets the replicas of app, their engines are built on first use like the primary's"""
+    replicas = app.extensions.get('replicas')
+    if replicas is None:
+        with _build_lock:
+            replicas = app.extensions.get('replicas')
+            if replicas is None:
+                replicas = app.extensions['replicas'] = ReplicaSet.from_config(app.config)
+    return replicas
+
+
+def wrote_recently():
+    """Checks if the requesting user wrote within the sticky window"""
+    try:
+        if float(request.cookies.get(STICKY_COOKIE, 0)) > time.time():
+            return True
+    except ValueError:
+        pass
+    identity = get_jwt_identity()
+    return identity is not None and recent_writers.get(identity) is not None
+
+
+def reads_own_writes():
+    """Checks if the request must see writes the replicas may not have yet"""
+    return bool(current_app.config['DB_REPLICA_URLS']) and (getattr(request, 'db_wrote', False) or wrote_recently())
+
+
+def read_replica():
+    """Checks if the request read from a replica"""
+    return bool(getattr(request, 'db_replica', None))
+
+
+def is_read(clause):
+    """Checks if a statement only reads and may run on a replica"""
+    return (isinstance(clause, GenerativeSelect) and clause._for_update_arg is None
+            and not clause.get_execution_options().get(PRIMARY_OPTION))
+
+
+def on_primary(statement):
+    """Marks a select or query to always read from the primary"""
+    return statement.execution_options(**{PRIMARY_OPTION: True})
+
+
+class RoutingSession(SignallingSession):
+    """
+    Session sending the reads of read-only requests to a replica.
+    What a request wrote and the replica it reads from are kept on the
+    request, an app context and its session can outlive a request.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        """Picks a replica for reads, the primary (or the model's bind) otherwise"""
+        bind = super().get_bind(mapper, clause)
+        if bind is not self.bind or not self.app.config['DB_REPLICA_URLS'] or not has_request_context():
+            return bind
+        current = request._get_current_object()
+        if self._flushing or isinstance(clause, UpdateBase):
+            current.db_wrote = True
+        if (getattr(current, 'db_wrote', False) or current.method not in READ_METHODS
+                or not is_read(clause) or wrote_recently()):
+            return bind
+        replica = getattr(current, 'db_replica', None)
+        if replica is None:
+            # False once the request fell back to the primary
+            replica = current.db_replica = replica_set(self.app).choose() or False
+        return replica.engine if replica else bind
+
+    def execute(self, *args, **kwargs):
+        """Runs a statement, again on the primary if the replica it went to failed"""
+        try:
+            return super().execute(*args, **kwargs)
+        except exc.DBAPIError:
+            replica = getattr(request, 'db_replica', None) if has_request_context() else None
+            # The replica's handle_error listener marks it down when it was the connection that failed
+            if not replica or replica.healthy:
+                raise
+            request.db_replica = False
+            return super().execute(*args, **kwargs)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy extension whose sessions are RoutingSessions"""
+
+    def create_session(self, options):
+        """Session factory making RoutingSessions"""
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def remember_writes(response):
+    """Keeps the reads of a user who just wrote on the primary for the sticky window"""
+    config = current_app.config
+    if config['DB_REPLICA_URLS'] and response.status_code < 400 and getattr(request, 'db_wrote', False):
+        window = config['DB_REPLICA_STICKY_SECONDS']
+        identity = get_jwt_identity()
+        if identity is not None:
+            recent_writers.set(identity, True, ttl=window)
+        response.set_cookie(STICKY_COOKIE, '{:.3f}'.format(time.time() + window),
+                            max_age=math.ceil(window), httponly=True, samesite='Lax')
+    return response
+
+
+def init_app(app):
+    """Remembers the users writing through app"""
+    app.after_request(remember_writes)
+
+
+def dispose(app):
+    """Drops the replica connections of app, if any were opened"""
+    replicas = app.extensions.get('replicas')
+    if replicas is not None:
+        replicas.dispose()
+
+
+def start_replica_checks(app, interval=None):
+    """
+    Probes the replicas every interval seconds on a daemon thread.
+    Does nothing without replicas or when the interval (DB_REPLICA_CHECK_INTERVAL by default) is 0.
+    """
+    interval = app.config['DB_REPLICA_CHECK_INTERVAL'] if interval is None else interval
+    if not interval or not app.config['DB_REPLICA_URLS']:
+        return None
+    replicas = replica_set(app)
+    stopped = threading.Event()
+
+    def run():
+        while True:
+            replicas.check(app.config['DB_REPLICA_MAX_LAG'], app.logger)
+            if stopped.wait(interval):
+                break
+
+    thread = threading.Thread(target=run, name='replica-checks', daemon=True)
+    thread.start()
+    return stopped
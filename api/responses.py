@@ -0,0 +1,59 @@
+"""JSON responses for the api resources.
+
+Bodies are encoded with orjson when it is installed and with the standard
+library otherwise. Dates are written as HTTP dates either way, the format
+flask.json has always produced for this api.
+"""
+
+import json
+
+from flask import Response
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+JSON_MIMETYPE = 'application/json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def _default(obj):
+    """Encodes values the JSON encoders do not handle natively"""
+    if hasattr(obj, 'timetuple'):
+        return http_date(obj)
+    raise TypeError('Object of type {} is not JSON serializable'.format(type(obj).__name__))
+
+
+def stdlib_dumps(obj):
+    """Encodes obj to JSON bytes with the standard library"""
+    return json.dumps(obj, default=_default).encode()
+
+
+def orjson_dumps(obj):
+    """Encodes obj to JSON bytes with orjson, integer keys (validation errors) become strings"""
+    return orjson.dumps(obj, default=_default,
+                        option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS)
+
+
+dumps = orjson_dumps if orjson else stdlib_dumps
+
+
+def json_response(payload, status=200):
+    """Builds a JSON response from a dict or list"""
+    return Response(dumps(payload), status=status, mimetype=JSON_MIMETYPE)
+
+
+def stream_list(key, rows):
+    """Streams rows as the JSON list {key: [...]} without building it in memory"""
+    yield b'{' + dumps(key) + b': ['
+    for index, row in enumerate(rows):
+        yield (b',' if index else b'') + dumps(row)
+    yield b']}'
+
+
+def stream_ndjson(rows):
+    """Streams rows as newline delimited JSON, one document per line"""
+    for row in rows:
+        yield dumps(row) + b'\n'
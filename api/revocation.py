@@ -0,0 +1,109 @@
+"""In-process set of revoked token ids backing the JWT blacklist check.
+
+The set is warmed from the revoked table on first use and afterwards only
+picks up rows added since the last refresh (a primary key range scan), at
+most once every REVOCATION_REFRESH_INTERVAL seconds. Tokens revoked by
+this process are added immediately, other workers see them after their
+next refresh. Entries are forgotten once the token itself has expired.
+
+Ids are handed out before commit, so a revocation can become visible after
+one with a higher id. Ids skipped by a refresh are looked up again on the
+following refreshes for GAP_WAIT seconds, after which they are taken to
+belong to rolled back transactions.
+"""
+
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+
+from sqlalchemy import or_
+
+from api import jwt, db
+from api.models import Revoked
+from api.replicas import on_primary
+
+# Seconds an id skipped by a refresh is waited for, and how far below a
+# newer id one is, at most. Pruned rows leave older gaps.
+GAP_WAIT = 300
+MAX_GAP = 1000
+
+
+class RevocationSet(object):
+    """Set of revoked JTIs kept in sync with the revoked table"""
+
+    def __init__(self):
+        """Init function"""
+        self._jtis = {}
+        self._last_id = 0
+        # Skipped ids not committed yet, with when they were first missed
+        self._gaps = {}
+        self._refreshed_at = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Loads revocations added since the last refresh, and those committed late"""
+        with self._lock:
+            newer = Revoked.id > self._last_id
+            if self._gaps:
+                newer = or_(newer, Revoked.id.in_(list(self._gaps)))
+            # A lagging replica would let a revoked token through again
+            rows = on_primary(db.session.query(Revoked.id, Revoked.jti, Revoked.expires_at)).filter(
+                newer).order_by(Revoked.id).all()
+            started = time.monotonic()
+            for id, jti, expires_at in rows:
+                self._jtis[jti] = expires_at
+                self._gaps.pop(id, None)
+                if id > self._last_id:
+                    self._gaps.update(dict.fromkeys(range(max(self._last_id + 1, id - MAX_GAP), id), started))
+                    self._last_id = id
+            for id, missed_at in list(self._gaps.items()):
+                if started - missed_at > GAP_WAIT:
+                    del self._gaps[id]
+            now = datetime.utcnow()
+            for jti, expires_at in list(self._jtis.items()):
+                if expires_at is not None and expires_at < now:
+                    del self._jtis[jti]
+            self._refreshed_at = time.monotonic()
+
+    def maybe_refresh(self):
+        """Refreshes when the set was never loaded or the interval has passed"""
+        interval = current_app.config.get('REVOCATION_REFRESH_INTERVAL', 30)
+        if self._refreshed_at is None or time.monotonic() - self._refreshed_at >= interval:
+            self.refresh()
+
+    def add(self, jti, expires_at=None):
+        """Marks a token as revoked in this process"""
+        self._jtis[jti] = expires_at
+
+    def clear(self):
+        """Forgets every revocation, the next check reloads them"""
+        with self._lock:
+            self._jtis.clear()
+            self._last_id = 0
+            self._gaps.clear()
+            self._refreshed_at = None
+
+    def __contains__(self, jti):
+        self.maybe_refresh()
+        return jti in self._jtis
+
+    def __len__(self):
+        return len(self._jtis)
+
+
+revoked_tokens = RevocationSet()
+
+
+@jwt.token_in_blacklist_loader
+def is_token_revoked(decrypted_token):
+    """Checks the token against the in-memory revocation set"""
+    return decrypted_token['jti'] in revoked_tokens
+
+
+def revoke(token):
+    """Persists the revocation of a decoded token and applies it to this process right away"""
+    expires_at = datetime.utcfromtimestamp(token['exp']) if token.get('exp') else None
+    Revoked(token['jti'], expires_at).save()
+    revoked_tokens.add(token['jti'], expires_at)
@@ -2,8 +2,8 @@
 
 from flask import Blueprint
 from flask_restful import Api
-from api.users.views import GetAllUsers, ReviewOps, ReviewHistory, GetUser
-from api.admin.views import AddBook, BookOps, PromoteUser
+from api.users.views import GetAllUsers, ReviewOps, BatchReviewOps, ReviewHistory, GetUser
+from api.admin.views import AddBook, BookOps, PromoteUser, UserRoles, ImportBooks, OutstandingReviews
 from api.books.views import GetBooks, GetBook
 from api.auth.views import Register, Login, Logout, ResetPassword
 
@@ -12,14 +12,18 @@ api = Api(mod)
 
 api.add_resource(AddBook, '/api/v1/books')
 api.add_resource(GetBooks, '/api/v1/books')
+api.add_resource(ImportBooks, '/api/v1/books/import')
 api.add_resource(GetBook, '/api/v1/book/<book_id>')
 api.add_resource(BookOps, '/api/v1/book/<book_id>')
 api.add_resource(GetAllUsers, '/api/v1/users')
 api.add_resource(GetUser, '/api/v1/user')
 api.add_resource(ReviewOps, '/api/v1/users/books/<book_id>')
 api.add_resource(ReviewHistory, '/api/v1/users/books')
+api.add_resource(BatchReviewOps, '/api/v1/users/books')
 api.add_resource(Register, '/api/v1/auth/register')
 api.add_resource(Login, '/api/v1/auth/login')
 api.add_resource(Logout, '/api/v1/auth/logout')
 api.add_resource(ResetPassword, '/api/v1/auth/reset-password')
-api.add_resource(PromoteUser, '/api/v1/user/promote')
\ No newline at end of file
+api.add_resource(PromoteUser, '/api/v1/user/promote')
+api.add_resource(UserRoles, '/api/v1/users/roles')
+api.add_resource(OutstandingReviews, '/api/v1/reviews/outstanding')
\ No newline at end of file
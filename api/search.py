@@ -0,0 +1,95 @@
+"""Full-text search over the book catalog.
+
+Postgres keeps a weighted tsvector column with a GIN index on books,
+SQLite keeps an external-content FTS5 table synced by triggers. Any other
+backend falls back to a case-insensitive LIKE over the same columns.
+"""
+
+import re
+
+from flask_sqlalchemy import Pagination
+from sqlalchemy import DDL, event, func, literal_column, or_, table, column
+
+SEARCH_CONFIG = 'english'
+# Relative weights of title, author and publisher matches
+FTS5_WEIGHTS = (10.0, 5.0, 1.0)
+
+PG_SEARCH_DDL = [
+    "ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(publisher, '')), 'C')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING GIN (search_vector)",
+]
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "title, author, publisher, content='books', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, title, author, publisher) "
+    "VALUES (new.id, new.title, new.author, new.publisher); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, publisher) "
+    "VALUES ('delete', old.id, old.title, old.author, old.publisher); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, publisher) "
+    "VALUES ('delete', old.id, old.title, old.author, old.publisher); "
+    "INSERT INTO books_fts(rowid, title, author, publisher) "
+    "VALUES (new.id, new.title, new.author, new.publisher); END",
+    "INSERT INTO books_fts(books_fts) VALUES ('rebuild')",
+]
+
+books_fts = table('books_fts', column('rowid'))
+
+
+def register_search_ddl(books_table):
+    """Creates (and drops) the search index together with the books table"""
+    for statement in PG_SEARCH_DDL:
+        event.listen(books_table, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+    for statement in SQLITE_SEARCH_DDL:
+        event.listen(books_table, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+    event.listen(books_table, 'before_drop',
+                 DDL("DROP TABLE IF EXISTS books_fts").execute_if(dialect='sqlite'))
+
+
+def fts5_query(q):
+    """Turns free text into an FTS5 query where every term must match"""
+    terms = re.findall(r'\w+', q)
+    return ' '.join('"{}"'.format(term) for term in terms)
+
+
+def ranked_query(model, q):
+    """Builds a query returning books matching q, best matches first"""
+    dialect = model.query.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        vector = literal_column('books.search_vector')
+        tsquery = func.websearch_to_tsquery(SEARCH_CONFIG, q)
+        return model.query.filter(vector.op('@@')(tsquery)).order_by(
+            func.ts_rank_cd(vector, tsquery).desc(), model.id)
+    if dialect == 'sqlite':
+        match = fts5_query(q)
+        if not match:
+            return None
+        fts = literal_column('books_fts')
+        return model.query.join(books_fts, books_fts.c.rowid == model.id).filter(
+            fts.op('MATCH')(match)).order_by(func.bm25(fts, *FTS5_WEIGHTS), model.id)
+    pattern = '%{}%'.format(q)
+    return model.query.filter(or_(
+        model.title.ilike(pattern), model.author.ilike(pattern), model.publisher.ilike(pattern)
+    )).order_by(model.id)
+
+
+def search(model, q, page=1, per_page=10):
+    """Runs a ranked search and pages it like Query.paginate, items are plain rows"""
+    page = max(page, 1)
+    per_page = max(per_page, 1)
+    query = ranked_query(model, q)
+    if query is None:
+        return Pagination(None, page, per_page, 0, [])
+    columns = [getattr(model, name) for name in model.LISTED_COLUMNS]
+    items = query.with_entities(*columns).limit(per_page).offset((page - 1) * per_page).all()
+    if page == 1 and len(items) < per_page:
+        total = len(items)
+    else:
+        total = query.order_by(None).count()
+    return Pagination(None, page, per_page, total, items)
@@ -0,0 +1,42 @@
+"""Precompiled serializers turning model records into response dicts.
+
+A serializer reads the loaded column values straight from an ORM
+instance's __dict__, so it skips attribute instrumentation, and falls back
+to plain attribute access for query rows, slotted records and expired
+instances. Serializers never write to the object.
+"""
+
+from operator import attrgetter, itemgetter
+
+
+def compile_serializer(fields, computed=()):
+    """
+    Builds a serializer from (key, attribute) pairs in output order.
+    computed holds (key, function of the serialized dict) pairs added after them.
+    """
+    keys = tuple(key for key, _ in fields)
+    attributes = tuple(attribute for _, attribute in fields)
+    from_dict = itemgetter(*attributes)
+    from_attributes = attrgetter(*attributes)
+
+    def serialize(obj):
+        try:
+            values = from_dict(obj.__dict__)
+        except (AttributeError, KeyError):
+            values = from_attributes(obj)
+        data = dict(zip(keys, values))
+        for key, compute in computed:
+            data[key] = compute(data)
+        return data
+
+    return serialize
+
+
+serialize_book = compile_serializer(
+    [("id", "id"), ("title", "title"), ("author", "author"), ("isbn", "isbn"),
+     ("publisher", "publisher"), ("quantity", "quantity")],
+    computed=[("availability", lambda book: book["quantity"] != 0)])
+
+serialize_user = compile_serializer(
+    [("email", "email"), ("username", "username"), ("firstName", "first_name"),
+     ("lastName", "last_name"), ("is_admin", "is_admin")])
@@ -0,0 +1,42 @@
+from api.validation import CompiledSchema
+from api.admin.validate import parse_date
+from api.pagination import positive_arg
+
+# Most books a single batch checkout or return may name
+MAX_BATCH = 100
+# Largest page of users a cursor request may ask for
+MAX_USER_PAGE = 1000
+
+BATCH_SCHEMA = CompiledSchema({
+    'books': {
+        'type': 'list',
+        'required': True,
+        'empty': False,
+        'maxlength': MAX_BATCH,
+        'schema': {'type': 'integer', 'min': 1}
+    }
+})
+
+
+def validate_batch(data):
+    """Validates a batch of book ids, returns the errors if any"""
+    return BATCH_SCHEMA.errors(data)
+
+
+def user_filters(args):
+    """Reads the user listing filters from query arguments, raises ValueError with the message of a bad one"""
+    admin = args.get('admin')
+    if admin not in (None, 'true', 'false'):
+        raise ValueError("admin must be true or false")
+    try:
+        joined_from = parse_date(args.get('joined_from'))
+        joined_to = parse_date(args.get('joined_to'))
+    except ValueError:
+        raise ValueError("Dates must be in YYYY-MM-DD format")
+    return {"admin": None if admin is None else admin == 'true', "joined_from": joined_from,
+            "joined_to": joined_to, "name": args.get('name') or None}
+
+
+def page_limit(value, default=50):
+    """Parses a page size argument, raises ValueError unless it is 1 to MAX_USER_PAGE"""
+    return positive_arg(value, default, MAX_USER_PAGE)
@@ -1,10 +1,15 @@
 from flask_restful import Resource, reqparse
-from flask import request, json, Response
-from flask_jwt_extended import get_jwt_identity, jwt_required
-from datetime import datetime
+from flask import request, Response, stream_with_context
+from flask_jwt_extended import jwt_required
+from itertools import chain
 
-from api.models import User, Book, ReviewBook
-from api.admin.validate import validate_arg, validate_book
+from api.identity import current_user
+from api.models import User, Book, ReviewBook, BatchConflict
+from api.admin.validate import validate_arg, validate_book, parse_date
+from api.users.validate import validate_batch, user_filters, page_limit, MAX_USER_PAGE
+from api.pagination import InvalidCursor, positive_arg
+from api.serializers import serialize_user
+from api.responses import json_response, stream_list, stream_ndjson, JSON_MIMETYPE, NDJSON_MIMETYPE
 
 parser = reqparse.RequestParser()
 
@@ -14,17 +19,51 @@ class GetAllUsers(Resource):
 
     @jwt_required
     def get(self):
-        """Function serving get all user api endpoint"""
-        current_user = get_jwt_identity()
-        user = User.get_user_by_username(current_user)
+        """
+        Function serving get all user api endpoint.
+        ?after=&limit= pages by cursor, format=ndjson (or Accept: application/x-ndjson)
+        streams one user per line, otherwise the full {"Users": [...]} list is streamed.
+        """
+        user = current_user()
         if user:
             if user.is_admin:
-                all_users = User.all_users()
-                if len(all_users) == 0:
-                    return Response(json.dumps({"Message": "No users found"}), status=404)
-                return Response(json.dumps({"Users": [user.serialize for user in all_users]}), status=200)
-            return Response(json.dumps({"Message": "User not an admin"}), status=401)
-        return Response(json.dumps({"Message": "User does not exist"}), status=404)
+                try:
+                    filters = user_filters(request.args)
+                except ValueError as e:
+                    return json_response({"Message": str(e)}, status=400)
+                if "after" in request.args or "limit" in request.args:
+                    return self.get_after(request.args.get("after"), filters)
+                if wants_ndjson():
+                    rows = (serialize_user(row) for row in User.stream_rows(**filters))
+                    return Response(stream_with_context(stream_ndjson(rows)), status=200, mimetype=NDJSON_MIMETYPE)
+                rows = User.stream_rows(**filters)
+                first = next(rows, None)
+                if first is None:
+                    return json_response({"Message": "No users found"}, status=404)
+                users = (serialize_user(row) for row in chain([first], rows))
+                return Response(stream_with_context(stream_list("Users", users)), status=200, mimetype=JSON_MIMETYPE)
+            return json_response({"Message": "User not an admin"}, status=401)
+        return json_response({"Message": "User does not exist"}, status=404)
+
+    @staticmethod
+    def get_after(after, filters):
+        """Serves the keyset paginated user listing (?after=<cursor>&limit=)"""
+        try:
+            limit = page_limit(request.args.get("limit"))
+        except ValueError:
+            return json_response({"Message": "limit must be between 1 and {}".format(MAX_USER_PAGE)}, status=400)
+        try:
+            users, next_cursor = User.seek(after=after, limit=limit, **filters)
+        except InvalidCursor:
+            return json_response({"Message": "Invalid cursor"}, status=400)
+        return json_response({"Users": [serialize_user(row) for row in users], "nextCursor": next_cursor}, status=200)
+
+
+def wants_ndjson():
+    """Checks if the client asked for newline delimited JSON"""
+    if request.args.get("format") == "ndjson":
+        return True
+    return request.accept_mimetypes.best_match([JSON_MIMETYPE, NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
 
 
 class GetUser(Resource):
@@ -33,11 +72,10 @@ class GetUser(Resource):
     @jwt_required
     def get(self):
         """Function serving get all user api endpoint"""
-        current_user = get_jwt_identity()
-        user = User.get_user_by_username(current_user)
+        user = current_user()
         if user:
-            return Response(json.dumps({"User": user.serialize}), status=200)
-        return Response(json.dumps({"Message": "User does not exist"}), status=404)
+            return json_response({"User": user.serialize}, status=200)
+        return json_response({"Message": "User does not exist"}, status=404)
 
 
 class ReviewOps(Resource):
@@ -46,46 +84,100 @@ class ReviewOps(Resource):
     @jwt_required
     def post(self, book_id):
         """Function serving review book api endpoint"""
-        current_user = get_jwt_identity()
-        user = User.get_user_by_username(current_user)
+        user = current_user()
         if user:
             if validate_arg(book_id):
-                return Response(json.dumps(validate_book(book_id)), status=400)
+                return json_response(validate_book(book_id), status=400)
             book = Book.get_book_by_id(book_id)
             if book:
-                if book.quantity == 0:
-                    return Response(json.dumps({"Message": "Book not available to review"}), status=404)
                 reviewed = ReviewBook.query.filter_by(user_id=user.id, book_id=book.id, reviewed=False).first()
                 if reviewed:
-                    return Response(json.dumps({"Message": "Already reviewed book"}), status=403)
-                ReviewBook(user=user, book=book).save()
-                book.quantity -= 1
-                book.save()
-                return Response(json.dumps({"Message": "Book reviewed successfully", "Book": book.serialize}), status=200)
-            return Response(json.dumps({"Message": "Book does not exist"}), status=404)
-        return Response(json.dumps({"Message": "User does not not exist"}), status=404)
+                    return json_response({"Message": "Already reviewed book"}, status=403)
+                if not ReviewBook.checkout(user.id, book.id):
+                    return json_response({"Message": "Book not available to review"}, status=404)
+                return json_response({"Message": "Book reviewed successfully", "Book": book.serialize}, status=200)
+            return json_response({"Message": "Book does not exist"}, status=404)
+        return json_response({"Message": "User does not not exist"}, status=404)
 
     @jwt_required
     def put(self, book_id):
         """Function serving return book api endpoint"""
-        current_user = get_jwt_identity()
-        user = User.get_user_by_username(current_user)
+        user = current_user()
         if user:
             if validate_arg(book_id):
-                return Response(json.dumps(validate_book(book_id)), status=403)
+                return json_response(validate_book(book_id), status=403)
             book = Book.get_book_by_id(book_id)
             if book:
                 to_return = ReviewBook.query.filter_by(user_id=user.id, book_id=book.id, reviewed=False).first()
                 if to_return:
-                    to_return.reviewed = True
-                    to_return.date_reviewed = datetime.now()
-                    to_return.save()
-                    book.quantity += 1
-                    book.save()
-                    return Response(json.dumps({"Message": "Book reviewed successfully"}), status=200)
-                return Response(json.dumps({"Message": "You had not reviewed this book"}), status=403)
-            return Response(json.dumps({"Message": "Book does not exist"}), status=404)
-        return Response(json.dumps({"Message": "User does not exist"}), status=404)
+                    if not to_return.check_in():
+                        return json_response({"Message": "Book already returned"}, status=409)
+                    return json_response({"Message": "Book reviewed successfully"}, status=200)
+                return json_response({"Message": "You had not reviewed this book"}, status=403)
+            return json_response({"Message": "Book does not exist"}, status=404)
+        return json_response({"Message": "User does not exist"}, status=404)
+
+
+# Status code and message of each batch outcome, as the single book endpoints answer them
+BATCH_OUTCOMES = {
+    "checked_out": (200, "Book reviewed successfully"),
+    "returned": (200, "Book returned successfully"),
+    "not_found": (404, "Book does not exist"),
+    "already_reviewing": (403, "Already reviewed book"),
+    "unavailable": (404, "Book not available to review"),
+    "not_reviewing": (403, "You had not reviewed this book"),
+}
+
+
+def batch_response(outcomes, done, verb):
+    """Reports the outcome of every book in a batch"""
+    results = [{"id": book_id, "status": BATCH_OUTCOMES[outcome][0], "Message": BATCH_OUTCOMES[outcome][1]}
+               for book_id, outcome in outcomes]
+    succeeded = sum(1 for _, outcome in outcomes if outcome == done)
+    return json_response({"Message": "{} of {} books {}".format(succeeded, len(outcomes), verb),
+                          "Results": results}, status=200)
+
+
+def batch_conflict():
+    """Answers a batch that kept losing races with concurrent ones, nothing of it was applied"""
+    return json_response({"Message": "The books changed while the batch ran, nothing was changed. Try again"},
+                         status=409)
+
+
+class BatchReviewOps(Resource):
+    """Review (checkout) and return several books in one call resource"""
+
+    @jwt_required
+    def post(self):
+        """Function serving batch review books api endpoint"""
+        user = current_user()
+        if user:
+            data = request.get_json(self)
+            errors = validate_batch(data)
+            if errors:
+                return json_response(errors, status=400)
+            try:
+                outcomes = ReviewBook.checkout_many(user.id, data['books'])
+            except BatchConflict:
+                return batch_conflict()
+            return batch_response(outcomes, "checked_out", "checked out")
+        return json_response({"Message": "User does not exist"}, status=404)
+
+    @jwt_required
+    def put(self):
+        """Function serving batch return books api endpoint"""
+        user = current_user()
+        if user:
+            data = request.get_json(self)
+            errors = validate_batch(data)
+            if errors:
+                return json_response(errors, status=400)
+            try:
+                outcomes = ReviewBook.check_in_many(user.id, data['books'])
+            except BatchConflict:
+                return batch_conflict()
+            return batch_response(outcomes, "returned", "returned")
+        return json_response({"Message": "User does not exist"}, status=404)
 
 
 class ReviewHistory(Resource):
@@ -94,18 +186,35 @@ class ReviewHistory(Resource):
     @jwt_required
     def get(self):
         """Function serving get user reviewing history api endpoint"""
-        current_user = get_jwt_identity()
-        user = User.get_user_by_username(current_user)
+        user = current_user()
         if user:
             args = parser.parse_args()
             reviewed = request.args.get('reviewed')
             if reviewed == 'false':
                 unreviewed_books = ReviewBook.get_books_not_reviewed(user.id)
                 if unreviewed_books:
-                    return Response(json.dumps({"unreviewed": unreviewed_books}), status=200)
-                return Response(json.dumps({"Message": "You do not have any unreviewed book"}), status=403)
-            review_history = ReviewBook.get_user_review_history(user.id)
-            if review_history:
-                return Response(json.dumps({"ReviewHistory": review_history}), status=200)
-            return Response(json.dumps({"Message": "You have not reviewed any book"}), status=404)
-        return Response(json.dumps({"Message": "User does not exist"}), status=404)
+                    return json_response({"unreviewed": unreviewed_books}, status=200)
+                return json_response({"Message": "You do not have any unreviewed book"}, status=403)
+            try:
+                start = parse_date(request.args.get('from'))
+                end = parse_date(request.args.get('to'))
+            except ValueError:
+                return json_response({"Message": "Dates must be in YYYY-MM-DD format"}, status=400)
+            try:
+                page = positive_arg(request.args.get('page'), 1)
+                # Without paging arguments the whole history is streamed
+                paged = 'page' in request.args or 'limit' in request.args
+                limit = page_limit(request.args.get('limit')) if paged else None
+            except ValueError:
+                return json_response(
+                    {"Message": "page must be a positive number and limit between 1 and {}".format(MAX_USER_PAGE)},
+                    status=400)
+            review_history = ReviewBook.get_user_review_history(
+                user.id, start=start, end=end, page=page, per_page=limit)
+            first = next(review_history, None)
+            if first:
+                rows = chain([first], review_history)
+                return Response(stream_with_context(stream_list("ReviewHistory", rows)),
+                                status=200, mimetype=JSON_MIMETYPE)
+            return json_response({"Message": "You have not reviewed any book"}, status=404)
+        return json_response({"Message": "User does not exist"}, status=404)
@@ -0,0 +1,36 @@
+"""Reusable Cerberus validators.
+
+Building a Validator normalizes and checks its schema, so each schema is
+compiled once instead of on every request. A Validator keeps the document
+it is validating on itself, so one instance is kept per thread.
+"""
+
+import threading
+
+from cerberus import Validator
+
+
+class CompiledSchema(object):
+    """A schema with a ready Validator for every thread that uses it"""
+
+    def __init__(self, schema):
+        """Init function, compiles the schema for the importing thread"""
+        self.schema = schema
+        self._local = threading.local()
+        self.validator()
+
+    def validator(self):
+        """Gets this thread's validator, compiling it on first use"""
+        validator = getattr(self._local, 'validator', None)
+        if validator is None:
+            validator = self._local.validator = Validator(self.schema)
+        return validator
+
+    def errors(self, data):
+        """Validates data once, returns its errors or None when valid"""
+        if not isinstance(data, dict):
+            return {"document": ["must be a JSON object"]}
+        validator = self.validator()
+        if validator.validate(data):
+            return None
+        return validator.errors
@@ -0,0 +1,419 @@
+"""Throughput and latency of every API route over a seeded synthetic dataset.
+
+Seeds N users, M books and K reviews into an empty database (a temporary
+SQLite file by default), then times each route registered in api/routes.py
+through the Flask test client and through a real threaded WSGI server.
+Request bodies and tokens are prepared before the clock starts. Results,
+including p50/p99 latency and status counts, are written as JSON so runs
+on different commits can be compared with --compare.
+
+Usage:
+    python -m benchmarks.bench_endpoints [--users 1000] [--books 5000] [--reviews 10000]
+        [--requests 200] [--concurrency 4] [--database URI] [--url URL]
+        [--output bench.json] [--compare previous.json]
+"""
+
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+PASSWORD = 'password1234'
+ADMIN = 'bench_admin'
+RESET_USER = 'bench_reset'
+
+
+def isbn_for(n):
+    """ISBN of the nth seeded or created book"""
+    return '978{:010d}'.format(n)
+
+
+def book_payload(n, **changes):
+    """JSON body describing book n"""
+    return dict({"title": "Book {}".format(n), "author": "Author {}".format(n % 500),
+                 "isbn": isbn_for(n), "publisher": "Publisher {}".format(n % 50),
+                 "quantity": 1000}, **changes)
+
+
+class Dataset(object):
+    """Sizes of the seeded data and counters handing out unique values"""
+
+    def __init__(self, users, books, reviews, spare):
+        """Init function"""
+        self.users = users
+        self.books = books
+        self.reviews = reviews
+        self.spare = spare
+        self._next = users + books + spare + 1
+        self._lock = threading.Lock()
+
+    def unique(self):
+        """A number no seeded or earlier created row uses"""
+        with self._lock:
+            self._next += 1
+            return self._next
+
+    @property
+    def spare_ids(self):
+        """Ids of books no review references, safe to delete"""
+        return range(self.books + 1, self.books + self.spare + 1)
+
+
+def seed(dataset, rng):
+    """Bulk inserts the dataset, every user gets the same password"""
+    from api import db
+    from api.hashing import hash_password
+    from api.models import Book, ReviewBook, User
+
+    pwhash = hash_password(PASSWORD)
+    today = date.today()
+    users = [{"email": "{}@bench.test".format(name), "username": name, "first_name": "Bench",
+              "last_name": name, "secure_password": pwhash, "is_admin": name == ADMIN,
+              "joined": today - timedelta(days=rng.randrange(365))}
+             for name in [ADMIN, RESET_USER] + ['user{}'.format(i) for i in range(dataset.users)]]
+    db.session.execute(User.__table__.insert(), users)
+    books = [dict(book_payload(n), created=datetime.now())
+             for n in range(1, dataset.books + dataset.spare + 1)]
+    db.session.execute(Book.__table__.insert(), books)
+    reviews = []
+    for _ in range(dataset.reviews):
+        reviewed = today - timedelta(days=rng.randrange(120))
+        reviews.append({"user_id": rng.randrange(3, dataset.users + 3),
+                        "book_id": rng.randrange(1, dataset.books + 1),
+                        "date_reviewed": reviewed, "date_of_review": reviewed + timedelta(days=30),
+                        "reviewed": rng.random() < 0.7})
+    db.session.execute(ReviewBook.__table__.insert(), reviews)
+    db.session.commit()
+
+
+def bearer(username):
+    """Authorization header with a fresh access token, no password hashing involved"""
+    from flask_jwt_extended import create_access_token
+    return {"Authorization": "Bearer " + create_access_token(identity=username)}
+
+
+def scenarios(dataset):
+    """
+    Maps (method, rule) to [(name, build)], build(i) returns the keyword
+    arguments of the ith request: path, query, json, data, content_type, headers.
+    """
+    def user_name(i):
+        return 'user{}'.format(i % dataset.users)
+
+    def review_id(i):
+        return i % dataset.books + 1
+
+    def batch(i):
+        first = i * 20 % dataset.books
+        return {"books": [first + n % dataset.books + 1 for n in range(20)]}
+
+    def import_csv(i):
+        first = dataset.unique() * 100
+        rows = ['title,author,isbn,publisher,quantity'] + [
+            'Imported {0},Author,{1},Publisher,5'.format(n, isbn_for(n)) for n in range(first, first + 100)]
+        return '\n'.join(rows)
+
+    pages = max(dataset.books // 20, 1)
+    return {
+        ('GET', '/api/v1/books'): [
+            ('list', lambda i: {"query": {"page": i % pages + 1, "limit": 20}}),
+            ('search', lambda i: {"query": {"q": "Book {}".format(i % dataset.books + 1)}}),
+            ('cursor', lambda i: {"query": {"after": "", "limit": 20, "sort": "title"}}),
+        ],
+        ('POST', '/api/v1/books'): [
+            ('add', lambda i: {"json": book_payload(dataset.unique()), "headers": bearer(ADMIN)}),
+        ],
+        ('POST', '/api/v1/books/import'): [
+            ('csv_100_rows', lambda i: {"data": import_csv(i), "content_type": "text/csv",
+                                        "headers": bearer(ADMIN)}),
+        ],
+        ('GET', '/api/v1/book/<book_id>'): [
+            ('get', lambda i: {"path": "/api/v1/book/{}".format(i % dataset.books + 1)}),
+        ],
+        ('PUT', '/api/v1/book/<book_id>'): [
+            ('update', lambda i: {"path": "/api/v1/book/{}".format(i % dataset.books + 1),
+                                  "json": book_payload(i % dataset.books + 1, quantity=999),
+                                  "headers": bearer(ADMIN)}),
+        ],
+        ('DELETE', '/api/v1/book/<book_id>'): [
+            ('delete', lambda i: {"path": "/api/v1/book/{}".format(dataset.spare_ids[i % dataset.spare]),
+                                  "headers": bearer(ADMIN)}),
+        ],
+        ('GET', '/api/v1/users'): [
+            ('all', lambda i: {"headers": bearer(ADMIN)}),
+        ],
+        ('GET', '/api/v1/user'): [
+            ('current', lambda i: {"headers": bearer(user_name(i))}),
+        ],
+        ('POST', '/api/v1/users/books/<book_id>'): [
+            ('checkout', lambda i: {"path": "/api/v1/users/books/{}".format(review_id(i)),
+                                    "headers": bearer(ADMIN)}),
+        ],
+        ('PUT', '/api/v1/users/books/<book_id>'): [
+            ('return', lambda i: {"path": "/api/v1/users/books/{}".format(review_id(i)),
+                                  "headers": bearer(ADMIN)}),
+        ],
+        ('POST', '/api/v1/users/books'): [
+            ('checkout_20', lambda i: {"json": batch(i), "headers": bearer(user_name(i))}),
+        ],
+        ('PUT', '/api/v1/users/books'): [
+            ('return_20', lambda i: {"json": batch(i), "headers": bearer(user_name(i))}),
+        ],
+        ('GET', '/api/v1/users/books'): [
+            ('history', lambda i: {"headers": bearer(user_name(i))}),
+            ('outstanding', lambda i: {"query": {"reviewed": "false"}, "headers": bearer(user_name(i))}),
+        ],
+        ('POST', '/api/v1/auth/register'): [
+            ('register', lambda i: register_payload(dataset.unique())),
+        ],
+        ('POST', '/api/v1/auth/login'): [
+            ('login', lambda i: {"json": {"username": user_name(i), "password": PASSWORD}}),
+        ],
+        ('POST', '/api/v1/auth/logout'): [
+            ('logout', lambda i: {"headers": bearer(user_name(i))}),
+        ],
+        ('POST', '/api/v1/auth/reset-password'): [
+            ('reset', lambda i: {"json": {"password": PASSWORD, "new_password": PASSWORD},
+                                 "headers": bearer(RESET_USER)}),
+        ],
+        ('POST', '/api/v1/user/promote'): [
+            ('promote', lambda i: {"json": {"username": user_name(i)}, "headers": bearer(ADMIN)}),
+        ],
+        ('POST', '/api/v1/users/roles'): [
+            ('promote_20', lambda i: {"json": {"usernames": [user_name(i + n) for n in range(20)], "is_admin": True},
+                                      "headers": bearer(ADMIN)}),
+        ],
+        ('GET', '/api/v1/reviews/outstanding'): [
+            ('page', lambda i: {"query": {"page": i % 10 + 1}, "headers": bearer(ADMIN)}),
+        ],
+    }
+
+
+def register_payload(n):
+    """Register request for a new user"""
+    name = 'new{}'.format(n)
+    return {"json": {"email": "{}@bench.test".format(name), "username": name, "first_name": "New",
+                     "last_name": "User", "password": PASSWORD, "confirm_password": PASSWORD}}
+
+
+def api_routes(app):
+    """(method, rule) of every route registered by api/routes.py"""
+    return sorted((method, rule.rule) for rule in app.url_map.iter_rules()
+                  if rule.endpoint.startswith('api.')
+                  for method in rule.methods - {'HEAD', 'OPTIONS'})
+
+
+def prepare(app, rule, build, first, count):
+    """Builds requests first to first + count up front so token signing is not timed"""
+    with app.test_request_context():
+        requests = []
+        for i in range(first, first + count):
+            spec = build(i)
+            spec.setdefault("path", rule)
+            if "json" in spec:
+                spec["data"] = json.dumps(spec.pop("json"))
+                spec["content_type"] = "application/json"
+            requests.append(spec)
+        return requests
+
+
+def summarize(latencies, statuses, elapsed):
+    """Throughput and latency percentiles of one scenario"""
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return ordered[min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1)] * 1000
+
+    return {"requests": len(ordered), "throughput": len(ordered) / elapsed if elapsed else None,
+            "p50_ms": percentile(50), "p99_ms": percentile(99),
+            "mean_ms": statistics.mean(ordered) * 1000, "max_ms": ordered[-1] * 1000,
+            "statuses": {str(code): statuses.count(code) for code in sorted(set(statuses))}}
+
+
+def run_test_client(app, method, requests):
+    """Sends requests one at a time through the Flask test client"""
+    client = app.test_client()
+    latencies, statuses = [], []
+    start = time.perf_counter()
+    for spec in requests:
+        sent = time.perf_counter()
+        res = client.open(spec["path"], method=method, query_string=spec.get("query"),
+                          data=spec.get("data"), content_type=spec.get("content_type"),
+                          headers=spec.get("headers"))
+        res.get_data()
+        latencies.append(time.perf_counter() - sent)
+        statuses.append(res.status_code)
+    return latencies, statuses, time.perf_counter() - start
+
+
+def run_http(base_url, method, requests, concurrency):
+    """Sends requests over HTTP from concurrency threads, each with its own connection"""
+    parts = urlsplit(base_url)
+    local = threading.local()
+
+    def send(spec):
+        if not hasattr(local, 'conn'):
+            local.conn = http.client.HTTPConnection(parts.hostname, parts.port, timeout=60)
+        path = spec["path"] + ('?' + urlencode(spec["query"]) if spec.get("query") else '')
+        headers = dict(spec.get("headers") or {})
+        if spec.get("content_type"):
+            headers["Content-Type"] = spec["content_type"]
+        body = spec.get("data")
+        sent = time.perf_counter()
+        try:
+            local.conn.request(method, path, body=body.encode() if body else None, headers=headers)
+            res = local.conn.getresponse()
+            res.read()
+            status = res.status
+        except (http.client.HTTPException, OSError):
+            local.conn.close()
+            status = 0
+        return time.perf_counter() - sent, status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(send, requests))
+    elapsed = time.perf_counter() - start
+    return [latency for latency, _ in results], [status for _, status in results], elapsed
+
+
+def start_server(app):
+    """Serves app from a threaded werkzeug server on a free port"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        # Keep-alive responses from this server stall on delayed ACKs, about 40ms each
+        protocol_version = 'HTTP/1.0'
+
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, 'http://127.0.0.1:{}'.format(server.server_port)
+
+
+def git_commit():
+    """Commit the tree is at, None outside a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, previous_path):
+    """Prints the p50 and p99 change of every scenario against an earlier run"""
+    with open(previous_path) as stream:
+        previous = json.load(stream)["results"]
+    print("\n{:<12}{:<52}{:>12}{:>12}".format('transport', 'scenario', 'p50 change', 'p99 change'))
+    for transport, scenarios_run in results.items():
+        for name, now in scenarios_run.items():
+            before = previous.get(transport, {}).get(name)
+            if not before:
+                continue
+            print("{:<12}{:<52}{:>+11.0%}{:>+12.0%}".format(
+                transport, name, now["p50_ms"] / before["p50_ms"] - 1, now["p99_ms"] / before["p99_ms"] - 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=10000)
+    parser.add_argument('--requests', type=int, default=200, help="timed requests per scenario")
+    parser.add_argument('--warmup', type=int, default=20, help="untimed requests per scenario")
+    parser.add_argument('--concurrency', type=int, default=4, help="client threads for the WSGI server")
+    parser.add_argument('--config', default='production')
+    parser.add_argument('--database', help="empty database URI, a temporary SQLite file by default")
+    parser.add_argument('--url', help="benchmark an already running server (sharing --database) "
+                                      "instead of starting one")
+    parser.add_argument('--transport', choices=['test_client', 'wsgi', 'both'], default='both')
+    parser.add_argument('--only', help="only run scenarios whose name contains this")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', default='bench_endpoints.json')
+    parser.add_argument('--compare', help="earlier JSON output to compare with")
+    args = parser.parse_args()
+
+    database = args.database or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench.db')
+    # The config classes read these when config.py is imported
+    for name in ('SQLALCHEMY_DATABASE_URI', 'TEST_SQLALCHEMY_DATABASE_URI', 'DB_URL'):
+        os.environ[name] = database
+    os.environ.setdefault('JWT_SECRET_KEY', 'bench-secret')
+
+    from api import create_app, db
+    from api.models import Book
+
+    app = create_app(args.config)
+    spare = (args.requests + args.warmup) * 2
+    dataset = Dataset(args.users, args.books, args.reviews, spare)
+    with app.app_context():
+        db.create_all()
+        if Book.query.first() is not None:
+            sys.exit("The benchmark database must be empty: {}".format(database))
+        started = time.perf_counter()
+        seed(dataset, random.Random(args.seed))
+        print("Seeded {} users, {} books, {} reviews in {:.1f}s".format(
+            args.users, args.books + spare, args.reviews, time.perf_counter() - started))
+
+    table = scenarios(dataset)
+    routes = api_routes(app)
+    uncovered = [' '.join(route) for route in routes if route not in table]
+    transports = ['test_client', 'wsgi'] if args.transport == 'both' else [args.transport]
+    server, base_url = (None, args.url) if args.url else start_server(app)
+    results = {transport: {} for transport in transports}
+    print("{:<12}{:<52}{:>10}{:>10}{:>10}  statuses".format('transport', 'scenario', 'req/s', 'p50 ms', 'p99 ms'))
+    for method, rule in routes:
+        for name, build in table.get((method, rule), []):
+            key = '{} {} [{}]'.format(method, rule, name)
+            if args.only and args.only not in key:
+                continue
+            for number, transport in enumerate(transports):
+                # Each transport checks out, returns and deletes its own books
+                per_run = args.warmup + args.requests
+                requests = prepare(app, rule, build, number * per_run, per_run)
+                if transport == 'test_client':
+                    run_test_client(app, method, requests[:args.warmup])
+                    timed = run_test_client(app, method, requests[args.warmup:])
+                else:
+                    run_http(base_url, method, requests[:args.warmup], args.concurrency)
+                    timed = run_http(base_url, method, requests[args.warmup:], args.concurrency)
+                stats = results[transport][key] = summarize(*timed)
+                print("{:<12}{:<52}{:>10.0f}{:>10.2f}{:>10.2f}  {}".format(
+                    transport, key, stats["throughput"], stats["p50_ms"], stats["p99_ms"], stats["statuses"]))
+    if server is not None:
+        server.shutdown()
+    for route in uncovered:
+        print("No benchmark scenario for {}".format(route))
+
+    report = {
+        "commit": git_commit(),
+        "created": datetime.utcnow().isoformat() + 'Z',
+        "python": platform.python_version(),
+        "database": database.split('://')[0],
+        "params": {"users": args.users, "books": args.books, "reviews": args.reviews,
+                   "requests": args.requests, "warmup": args.warmup,
+                   "concurrency": args.concurrency, "config": args.config},
+        "uncovered": uncovered,
+        "results": results,
+    }
+    with open(args.output, 'w') as stream:
+        json.dump(report, stream, indent=2)
+    print("Results written to {}".format(args.output))
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Cold start cost of a worker: importing the app, building it and serving a first request.
+
+Every run is a fresh interpreter so nothing is already imported. The
+slowest imports are read from `python -X importtime`.
+
+Usage:
+    python -m benchmarks.bench_startup [--runs 5] [--config testing] [--top 10]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import api
+imported = time.perf_counter()
+app = api.create_app({config!r})
+created = time.perf_counter()
+with app.app_context():
+    api.db.create_all()
+app.test_client().get('/api/v1/books')
+served = time.perf_counter()
+print(json.dumps({{"import": imported - start, "create_app": created - imported,
+                  "first_request": served - created}}))
+"""
+
+
+def run_probe(config):
+    """Times one cold start in a fresh interpreter"""
+    out = subprocess.run([sys.executable, '-c', PROBE.format(config=config)],
+                         check=True, capture_output=True, text=True, env=os.environ.copy())
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top):
+    """Returns the top (cumulative microseconds, module) pairs from -X importtime"""
+    out = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import api.routes'],
+                         check=True, capture_output=True, text=True, env=os.environ.copy())
+    timings = []
+    for line in out.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module = line[len('import time:'):].split('|')
+        timings.append((int(cumulative), module.strip()))
+    return sorted(timings, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--config', default='testing')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    runs = [run_probe(args.config) for _ in range(args.runs)]
+    print(f"{'phase':<15}{'median ms':>12}{'max ms':>10}")
+    for phase in ('import', 'create_app', 'first_request'):
+        times = [run[phase] * 1000 for run in runs]
+        print(f"{phase:<15}{statistics.median(times):>12.1f}{max(times):>10.1f}")
+    print("\nSlowest imports (cumulative ms):")
+    for cumulative, module in slowest_imports(args.top):
+        print(f"{cumulative / 1000:>10.1f}  {module}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Per-request validation overhead, before and after caching the validators.
+
+"before" builds a new Validator for the schema on every call, as the
+validate_* functions used to, and runs it twice for an invalid document
+(once to check, once to build the error response). "after" is the current
+validate_* function called once.
+
+Usage:
+    python -m benchmarks.bench_validation [--number 500]
+"""
+
+import argparse
+import copy
+import timeit
+
+from cerberus import Validator
+
+from api.admin.validate import BOOK_SCHEMA, validate_book
+from api.auth.validate import REGISTER_SCHEMA, LOGIN_SCHEMA, validate_register, validate_login
+
+BOOK = {"title": "Windmills of Gods", "author": "Sidney Sheldon", "isbn": "3652472876",
+        "publisher": "Publisher", "quantity": 45}
+REGISTER = {"email": "zootest@yahoo.com", "username": "zootest", "first_name": "Zootest",
+            "last_name": "Gang", "password": "password1234", "confirm_password": "password1234"}
+LOGIN = {"username": "zootest", "password": "password1234"}
+
+CASES = [
+    ("book", BOOK_SCHEMA.schema, validate_book, BOOK, dict(BOOK, title="")),
+    ("register", REGISTER_SCHEMA.schema, validate_register, REGISTER, dict(REGISTER, email="hgtfd")),
+    ("login", LOGIN_SCHEMA.schema, validate_login, LOGIN, dict(LOGIN, password="")),
+]
+
+
+def rebuild_per_call(schema, data):
+    """The old validation path"""
+    validator = Validator(schema)
+    validator.validate(data)
+    if validator.errors:
+        validator = Validator(schema)
+        validator.validate(data)
+    return validator.errors
+
+
+def best_of(func, number, repeat=5):
+    """Best time per call in microseconds"""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--number', type=int, default=500, help='calls per timing run')
+    args = parser.parse_args()
+    print('{:<10} {:<8} {:>12} {:>12} {:>8}'.format('schema', 'document', 'before (us)', 'after (us)', 'speedup'))
+    for name, schema, validate, valid, invalid in CASES:
+        for label, document in (('valid', valid), ('invalid', invalid)):
+            before = best_of(lambda: rebuild_per_call(schema, copy.copy(document)), args.number)
+            after = best_of(lambda: validate(copy.copy(document)), args.number)
+            print('{:<10} {:<8} {:>12.1f} {:>12.1f} {:>7.1f}x'.format(name, label, before, after, before / after))
+
+
+if __name__ == '__main__':
+    main()
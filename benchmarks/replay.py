@@ -0,0 +1,301 @@
+"""Replays a recorded JSONL request trace against the API to reproduce load.
+
+Each line of the trace is one request:
+
+    {"ts": 12.5, "method": "GET", "path": "/api/v1/books", "query": {"page": 2}}
+    {"ts": 12.9, "method": "POST", "path": "/api/v1/users/books/7", "user": "user12"}
+    {"ts": 13.0, "method": "POST", "path": "/api/v1/books", "json": {...}, "user": "bench_admin"}
+
+"ts" (seconds, optional) is when it was recorded, "user" makes the request
+as that user. The harness logs users in itself (with "password" from the
+line or --password), logs them in again before their token expires, and
+retries once with a new token when a request is rejected for its token.
+
+Requests go out from --concurrency threads in trace order, paced by --rate
+requests per second, by the recorded timestamps (--speed 2 replays twice
+as fast) or as fast as possible. When paced, latency is measured from the
+time a request was due, so a server falling behind shows up in the
+percentiles instead of slowing the replay down.
+
+--start-server runs gunicorn with the production config against --database
+(a temporary SQLite file by default), after creating the tables and, with
+--seed, the synthetic users and books of bench_endpoints, whose users
+sample.jsonl replays.
+
+Usage:
+    python -m benchmarks.replay benchmarks/traces/sample.jsonl --start-server --seed
+        [--workers 2] [--database URI] [--concurrency 8] [--rate 50 | --speed 1]
+        [--repeat 10] [--output replay.json]
+    python -m benchmarks.replay trace.jsonl --url http://127.0.0.1:8000
+"""
+
+import argparse
+import base64
+import http.client
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlencode, urlsplit
+
+from benchmarks.bench_endpoints import PASSWORD, Dataset, git_commit, seed, summarize
+
+LOGIN_PATH = '/api/v1/auth/login'
+LOGOUT_PATH = '/api/v1/auth/logout'
+# Seconds before expiry a token is replaced
+TOKEN_MARGIN = 30
+
+
+def read_trace(path):
+    """Loads the requests of a JSONL trace, skipping blank lines"""
+    with open(path) as stream:
+        return [json.loads(line) for line in stream if line.strip()]
+
+
+def token_expiry(token):
+    """Reads the exp claim of a JWT without verifying it"""
+    payload = token.split('.')[1]
+    claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+    return claims.get('exp', float('inf'))
+
+
+class Connection(object):
+    """One keep-alive HTTP connection per thread"""
+
+    def __init__(self, base_url):
+        """Init function"""
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port
+        self._local = threading.local()
+
+    def send(self, method, path, query=None, body=None, headers=None):
+        """Returns (status, body), status 0 when the connection failed"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        if query:
+            path += '?' + urlencode(query, doseq=True)
+        headers = dict(headers or {})
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers['Content-Type'] = 'application/json'
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            res = conn.getresponse()
+            return res.status, res.read()
+        except (http.client.HTTPException, OSError):
+            conn.close()
+            self._local.conn = None
+            return 0, b''
+
+
+class Tokens(object):
+    """Access tokens per user, logging in on first use and before expiry"""
+
+    def __init__(self, connection, password):
+        """Init function"""
+        self.connection = connection
+        self.password = password
+        self.logins = []
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def get(self, user, password=None):
+        """Gets a live token for user, None when the login failed"""
+        with self._lock:
+            lock = self._locks.setdefault(user, threading.Lock())
+        with lock:
+            token = self._tokens.get(user)
+            if token and token_expiry(token) - TOKEN_MARGIN > time.time():
+                return token
+            started = time.perf_counter()
+            status, body = self.connection.send(
+                'POST', LOGIN_PATH, body={"username": user, "password": password or self.password})
+            self.logins.append((time.perf_counter() - started, status))
+            token = json.loads(body).get('Token') if status == 200 else None
+            self._tokens[user] = token
+            return token
+
+    def drop(self, user, token):
+        """Forgets a token the server no longer accepts"""
+        with self._lock:
+            if self._tokens.get(user) == token:
+                self._tokens.pop(user)
+
+
+def route_of(app, method, path):
+    """Rule a request path matches, so stats group /book/1 and /book/2"""
+    from werkzeug.exceptions import HTTPException
+    try:
+        rule, _ = app.url_map.bind('localhost').match(path, method, return_rule=True)
+        return '{} {}'.format(method, rule.rule)
+    except HTTPException:
+        return '{} {} (unmatched)'.format(method, path)
+
+
+def replay(entries, connection, tokens, concurrency, rate=None, speed=None):
+    """Sends every entry, returns [(entry, latency seconds, status)]"""
+    start = time.perf_counter() + 0.1
+    first_ts = entries[0].get('ts', 0) if entries else 0
+
+    def due(i, entry):
+        if rate:
+            return start + i / rate
+        if speed and 'ts' in entry:
+            return start + (entry['ts'] - first_ts) / speed
+        return None
+
+    def send(item):
+        i, entry = item
+        scheduled = due(i, entry)
+        if scheduled is not None:
+            time.sleep(max(0.0, scheduled - time.perf_counter()))
+        sent = time.perf_counter()
+        user = entry.get('user')
+        status = 0
+        for attempt in range(2):
+            headers = dict(entry.get('headers') or {})
+            token = None
+            if user:
+                token = tokens.get(user, entry.get('password'))
+                if token is None:
+                    status = 401
+                    break
+                headers['Authorization'] = 'Bearer ' + token
+            status, _ = connection.send(entry.get('method', 'GET'), entry['path'],
+                                        entry.get('query'), entry.get('json'), headers)
+            if token and (status in (401, 422) or entry['path'] == LOGOUT_PATH):
+                tokens.drop(user, token)
+                if status in (401, 422):
+                    continue
+            break
+        return entry, time.perf_counter() - (scheduled or sent), status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(send, enumerate(entries)))
+
+
+def report(app, results, elapsed):
+    """Groups results by route, with error rates next to the latency summary"""
+    by_route = {}
+    for entry, latency, status in results:
+        route = route_of(app, entry.get('method', 'GET'), entry['path'])
+        latencies, statuses = by_route.setdefault(route, ([], []))
+        latencies.append(latency)
+        statuses.append(status)
+    routes = {}
+    for route, (latencies, statuses) in sorted(by_route.items()):
+        stats = summarize(latencies, statuses, elapsed)
+        failed = sum(1 for status in statuses if status == 0 or status >= 500)
+        stats["error_rate"] = failed / len(statuses)
+        stats["client_error_rate"] = sum(1 for status in statuses if 400 <= status < 500) / len(statuses)
+        routes[route] = stats
+    overall = summarize([latency for _, latency, _ in results], [status for _, _, status in results], elapsed)
+    overall["error_rate"] = sum(1 for _, _, status in results if status == 0 or status >= 500) / len(results)
+    return overall, routes
+
+
+def free_port():
+    """A port nothing listens on right now"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_gunicorn(workers, env):
+    """Starts gunicorn on manage:app and waits until it answers"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--preload', '-w', str(workers), '-b', '127.0.0.1:{}'.format(port),
+         '--log-level', 'warning', 'manage:app'], env=env)
+    url = 'http://127.0.0.1:{}'.format(port)
+    connection = Connection(url)
+    deadline = time.monotonic() + 30
+    while connection.send('GET', '/metrics')[0] != 200:
+        if process.poll() is not None or time.monotonic() > deadline:
+            process.kill()
+            sys.exit("gunicorn did not start")
+        time.sleep(0.2)
+    return process, url
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('trace')
+    parser.add_argument('--url', help="server to replay against")
+    parser.add_argument('--start-server', action='store_true', help="start gunicorn on --database")
+    parser.add_argument('--workers', type=int, default=2, help="gunicorn workers")
+    parser.add_argument('--database', help="database for --start-server, a temporary SQLite file by default")
+    parser.add_argument('--seed', action='store_true', help="seed the synthetic dataset first")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--reviews', type=int, default=10000)
+    parser.add_argument('--password', default=PASSWORD, help="password of the trace's users")
+    parser.add_argument('--concurrency', type=int, default=8)
+    pacing = parser.add_mutually_exclusive_group()
+    pacing.add_argument('--rate', type=float, help="requests per second")
+    pacing.add_argument('--speed', type=float, help="replay the recorded timestamps this many times faster")
+    parser.add_argument('--repeat', type=int, default=1, help="replay the trace this many times")
+    parser.add_argument('--output', default='replay.json')
+    args = parser.parse_args()
+    if not args.url and not args.start_server:
+        parser.error("give --url or --start-server")
+
+    database = args.database or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'replay.db')
+    env = dict(os.environ, FLASK_CONFIG='production', DB_URL=database)
+    env.setdefault('JWT_SECRET_KEY', 'replay-secret')
+    env.setdefault('PROMETHEUS_MULTIPROC_DIR', tempfile.mkdtemp())
+    os.environ.update(env)
+
+    from api import create_app, db
+    app = create_app('production')
+    if args.start_server:
+        with app.app_context():
+            db.create_all()
+            if args.seed:
+                seed(Dataset(args.users, args.books, args.reviews, 0), random.Random(42))
+
+    entries = read_trace(args.trace)
+    if args.repeat > 1:
+        span = max((entry.get('ts', 0) for entry in entries), default=0) + 1
+        entries = [dict(entry, ts=entry.get('ts', 0) + span * n)
+                   for n, entry in itertools.product(range(args.repeat), entries)]
+        entries.sort(key=lambda entry: entry['ts'])
+    process, url = start_gunicorn(args.workers, env) if args.start_server else (None, args.url)
+    try:
+        connection = Connection(url)
+        tokens = Tokens(connection, args.password)
+        started = time.perf_counter()
+        results = replay(entries, connection, tokens, args.concurrency, args.rate, args.speed)
+        elapsed = time.perf_counter() - started
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    overall, routes = report(app, results, elapsed)
+    print("{:<48}{:>8}{:>9}{:>9}{:>10}{:>10}".format('route', 'count', 'req/s', 'errors', 'p50 ms', 'p99 ms'))
+    for route, stats in list(routes.items()) + [('all', overall)]:
+        print("{:<48}{:>8}{:>9.1f}{:>9.1%}{:>10.2f}{:>10.2f}".format(
+            route, stats["requests"], stats["throughput"], stats["error_rate"], stats["p50_ms"], stats["p99_ms"]))
+    print("{} logins by the harness".format(len(tokens.logins)))
+    with open(args.output, 'w') as stream:
+        json.dump({"commit": git_commit(), "created": datetime.utcnow().isoformat() + 'Z',
+                   "trace": args.trace, "params": {"concurrency": args.concurrency, "rate": args.rate,
+                                                   "speed": args.speed, "repeat": args.repeat,
+                                                   "workers": args.workers if args.start_server else None},
+                   "logins": len(tokens.logins), "overall": overall, "routes": routes}, stream, indent=2)
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -10,8 +10,42 @@ class Config(object):
     CSRF_ENABLED = True
     TESTING = False
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
-    JWT_BLACKLIST_ENABLED = False
+    JWT_BLACKLIST_ENABLED = True
     JWT_BLACKLIST_TOKEN_CHECKS = ['access']
+    # Seconds between checks for tokens revoked by other workers
+    REVOCATION_REFRESH_INTERVAL = int(os.getenv('REVOCATION_REFRESH_INTERVAL', 30))
+    # Seconds between in-process prunes of expired tokens, 0 leaves it to `flask prune_tokens`
+    TOKEN_PRUNE_INTERVAL = int(os.getenv('TOKEN_PRUNE_INTERVAL', 0))
+    TOKEN_PRUNE_BATCH_SIZE = int(os.getenv('TOKEN_PRUNE_BATCH_SIZE', 1000))
+    # Password hashing cost, stored hashes made with other settings are upgraded on login
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:260000')
+    PASSWORD_SALT_LENGTH = int(os.getenv('PASSWORD_SALT_LENGTH', 16))
+    # Hashing processes per worker (0 hashes in the request thread) and queued hashes allowed
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 8))
+    # Seconds a user record stays cached for JWT identity lookups, 0 disables it
+    IDENTITY_CACHE_TTL = int(os.getenv('IDENTITY_CACHE_TTL', 60))
+    IDENTITY_CACHE_SIZE = int(os.getenv('IDENTITY_CACHE_SIZE', 10000))
+    # Seconds a serialized book response is reused, writes in this process invalidate it sooner
+    RESPONSE_CACHE_TTL = int(os.getenv('RESPONSE_CACHE_TTL', 5))
+    RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', 2048))
+    # Connections kept open per worker and extra ones opened under load, ignored by SQLite
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    # Seconds to wait for a free connection, and before a connection is replaced
+    DB_POOL_TIMEOUT = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+    # Test connections on checkout so ones dropped by a failover are replaced
+    DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+    # Milliseconds a Postgres statement may run, 0 for no limit
+    DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 0))
+    # Comma separated read replica URLs, reads of GET requests are spread over them
+    DB_REPLICA_URLS = [url.strip() for url in os.getenv('DB_REPLICA_URLS', '').split(',') if url.strip()]
+    # Seconds a user's reads stay on the primary after they wrote, keep it above the replication lag
+    DB_REPLICA_STICKY_SECONDS = float(os.getenv('DB_REPLICA_STICKY_SECONDS', 5))
+    # Seconds between replica health checks, and the lag in seconds a Postgres replica may have
+    DB_REPLICA_CHECK_INTERVAL = int(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
+    DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
     # SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URL')
 
 
@@ -20,6 +54,8 @@ class DevelopmentConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 2))
+    DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 2))
 
 
 class TestingConfig(Config):
@@ -27,6 +63,11 @@ class TestingConfig(Config):
     TESTING = True
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.getenv('TEST_SQLALCHEMY_DATABASE_URI')
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    DB_POOL_SIZE = 2
+    DB_MAX_OVERFLOW = 0
+    DB_POOL_PRE_PING = False
+    DB_REPLICA_URLS = []
 
 
 class ProductionConfig(Config):
@@ -34,6 +75,7 @@ class ProductionConfig(Config):
     DEBUG = False
     TESTING = False
     SQLALCHEMY_DATABASE_URI = os.getenv('DB_URL')
+    DB_STATEMENT_TIMEOUT = int(os.getenv('DB_STATEMENT_TIMEOUT', 30000))
 
 
 app_config = {
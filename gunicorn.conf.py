@@ -0,0 +1,25 @@
+"""Gunicorn settings, read from the working directory by `gunicorn manage:app`"""
+import os
+
+# Import the app once in the master so workers fork with it already loaded
+preload_app = True
+workers = int(os.getenv('WEB_CONCURRENCY', 2))
+
+
+def post_fork(server, worker):
+    """Gives each worker its own connection pools, token pruner and replica checks"""
+    from api import dispose_engines
+    from api.pruning import start_pruner
+    from api.replicas import start_replica_checks
+    from manage import app
+
+    dispose_engines(app)
+    start_pruner(app)
+    start_replica_checks(app)
+
+
+def child_exit(server, worker):
+    """Drops the live pool gauges of an exited worker"""
+    from api.metrics import mark_process_dead
+
+    mark_process_dead(worker.pid)
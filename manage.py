@@ -1,13 +1,15 @@
 """Manage file"""
+import click
 from flask import render_template
 from flask_migrate import Migrate
 
-from api import db, app
-from api import routes
+from api import db, create_app
 from api.models import User
+from api.admin import importer
+from api.pruning import prune_tokens, start_pruner
+from api.replicas import start_replica_checks
 
-app.register_blueprint(routes.mod)
-
+app = create_app()
 migrate = Migrate(app, db)
 
 
@@ -40,6 +42,34 @@ def create_admin():
     print('Admin user created successfully')
 
 
+@app.cli.command("import_books")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(["csv", "jsonl"]), default=None,
+              help="Input format, guessed from the file extension by default")
+@click.option("--batch-size", default=importer.BATCH_SIZE, show_default=True,
+              help="Number of books inserted per statement")
+def import_books(path, fmt, batch_size):
+    """Bulk import books from a CSV or JSONL file"""
+    fmt = fmt or importer.detect_format(path)
+    with open(path, encoding='utf-8', newline='') as stream:
+        try:
+            report = importer.import_books(importer.read_rows(stream, fmt), batch_size=batch_size)
+        except importer.UnreadableImport as e:
+            raise click.ClickException(f"{e}, imported {e.report['imported']} books before the bad data")
+    for rejected in report['errors']:
+        print(f"line {rejected['line']}: {rejected['isbn']} {rejected['errors']}")
+    print(f"Imported {report['imported']} books, rejected {report['rejected']} rows")
+
+
+@app.cli.command("prune_tokens")
+@click.option("--batch-size", default=None, type=int,
+              help="Rows deleted per statement, TOKEN_PRUNE_BATCH_SIZE by default")
+def prune_expired_tokens(batch_size):
+    """Delete expired login tokens and revocations"""
+    pruned = prune_tokens(batch_size or app.config['TOKEN_PRUNE_BATCH_SIZE'])
+    print(f"Pruned {pruned['tokens']} tokens and {pruned['revoked']} revocations")
+
+
 @app.cli.command("tests")
 def test():
     """
@@ -52,4 +82,6 @@ def test():
 
 
 if __name__ == '__main__':
+    start_pruner(app)
+    start_replica_checks(app)
     app.run()
@@ -0,0 +1,63 @@
+"""books full text search
+
+Revision ID: 3b1e7c9d2a40
+Revises: f676a142d437
+Create Date: 2026-10-18 10:12:41.318207
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# The search DDL as of this revision, api.search keeps the current one
+PG_SEARCH_DDL = [
+    "ALTER TABLE books ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(author, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(publisher, '')), 'C')) STORED",
+    "CREATE INDEX IF NOT EXISTS ix_books_search_vector ON books USING GIN (search_vector)",
+]
+
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS books_fts USING fts5("
+    "title, author, publisher, content='books', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_insert AFTER INSERT ON books BEGIN "
+    "INSERT INTO books_fts(rowid, title, author, publisher) "
+    "VALUES (new.id, new.title, new.author, new.publisher); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_delete AFTER DELETE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, publisher) "
+    "VALUES ('delete', old.id, old.title, old.author, old.publisher); END",
+    "CREATE TRIGGER IF NOT EXISTS books_fts_update AFTER UPDATE ON books BEGIN "
+    "INSERT INTO books_fts(books_fts, rowid, title, author, publisher) "
+    "VALUES ('delete', old.id, old.title, old.author, old.publisher); "
+    "INSERT INTO books_fts(rowid, title, author, publisher) "
+    "VALUES (new.id, new.title, new.author, new.publisher); END",
+    "INSERT INTO books_fts(books_fts) VALUES ('rebuild')",
+]
+
+
+# revision identifiers, used by Alembic.
+revision = '3b1e7c9d2a40'
+down_revision = 'f676a142d437'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        for statement in PG_SEARCH_DDL:
+            op.execute(statement)
+    elif dialect == 'sqlite':
+        for statement in SQLITE_SEARCH_DDL:
+            op.execute(statement)
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_books_search_vector', table_name='books')
+        op.drop_column('books', 'search_vector')
+    elif dialect == 'sqlite':
+        for trigger in ('books_fts_insert', 'books_fts_delete', 'books_fts_update'):
+            op.execute('DROP TRIGGER IF EXISTS {}'.format(trigger))
+        op.execute('DROP TABLE IF EXISTS books_fts')
@@ -0,0 +1,107 @@
+"""store tokens and revocations by jti with expiry
+
+Revision ID: 5e0c4b7a9f21
+Revises: d27b8e0a4f65
+Create Date: 2026-10-18 13:06:45.772391
+
+"""
+import base64
+import json
+from datetime import datetime, timedelta
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e0c4b7a9f21'
+down_revision = 'd27b8e0a4f65'
+branch_labels = None
+depends_on = None
+
+# Longest lifetime of a token issued before this migration
+TOKEN_LIFETIME = timedelta(days=30)
+# Rows deleted per statement
+DELETE_BATCH = 500
+
+
+def _claims(value, bare_jti):
+    """
+    Gets (jti, expiry) of a stored full encoded JWT, or of a jti when bare_jti.
+    The payload is read without checking the signature, the rows were written by the app.
+    """
+    if not value:
+        return None, None
+    parts = value.split('.')
+    if len(parts) != 3:
+        return (value, None) if bare_jti and len(value) <= 36 else (None, None)
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(parts[1] + '=' * (-len(parts[1]) % 4)))
+    except (TypeError, ValueError):
+        return None, None
+    if not isinstance(payload, dict):
+        return None, None
+    jti, exp = payload.get('jti'), payload.get('exp')
+    if not isinstance(jti, str) or len(jti) > 36:
+        return None, None
+    return jti, datetime.utcfromtimestamp(exp) if isinstance(exp, (int, float)) else None
+
+
+def _to_jti(table_name, bare_jti):
+    """
+    Fills jti and expires_at from the token column of table_name. Rows that
+    can't be read, have expired or repeat a jti are deleted, the unique
+    index on jti would not take them.
+    """
+    bind = op.get_bind()
+    table = sa.table(table_name, sa.column('id', sa.Integer()), sa.column('token', sa.String()),
+                     sa.column('jti', sa.String()), sa.column('expires_at', sa.DateTime()))
+    now = datetime.utcnow()
+    seen, dropped, rows = set(), [], []
+    for id, value in bind.execute(sa.select(table.c.id, table.c.token).order_by(table.c.id)).fetchall():
+        jti, expires_at = _claims(value, bare_jti)
+        if jti is None or jti in seen or (expires_at is not None and expires_at <= now):
+            dropped.append(id)
+            continue
+        seen.add(jti)
+        rows.append({'row_id': id, 'new_jti': jti, 'new_expires_at': expires_at or now + TOKEN_LIFETIME})
+    for start in range(0, len(dropped), DELETE_BATCH):
+        bind.execute(table.delete().where(table.c.id.in_(dropped[start:start + DELETE_BATCH])))
+    if rows:
+        bind.execute(table.update().where(table.c.id == sa.bindparam('row_id'))
+                     .values(jti=sa.bindparam('new_jti'), expires_at=sa.bindparam('new_expires_at')), rows)
+
+
+def upgrade():
+    # tokens hold full encoded JWTs, revoked holds jtis or full JWTs
+    for table_name, bare_jti in (('tokens', False), ('revoked', True)):
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.add_column(sa.Column('jti', sa.String(length=36), nullable=True))
+            batch_op.add_column(sa.Column('expires_at', sa.DateTime(), nullable=True))
+        _to_jti(table_name, bare_jti)
+        with op.batch_alter_table(table_name) as batch_op:
+            batch_op.drop_index('ix_{}_token'.format(table_name))
+            batch_op.drop_column('token')
+            batch_op.create_index('ix_{}_jti'.format(table_name), ['jti'], unique=True)
+            batch_op.create_index('ix_{}_expires_at'.format(table_name), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('revoked') as batch_op:
+        batch_op.drop_index('ix_revoked_expires_at')
+        batch_op.drop_index('ix_revoked_jti')
+        batch_op.drop_column('expires_at')
+        batch_op.alter_column('jti', new_column_name='token',
+                              existing_type=sa.String(length=36), type_=sa.String(length=1000))
+    with op.batch_alter_table('revoked') as batch_op:
+        batch_op.create_index('ix_revoked_token', ['token'], unique=False)
+
+    # The full tokens can't be rebuilt from a jti
+    op.execute('DELETE FROM tokens')
+    with op.batch_alter_table('tokens') as batch_op:
+        batch_op.drop_index('ix_tokens_expires_at')
+        batch_op.drop_index('ix_tokens_jti')
+        batch_op.drop_column('expires_at')
+        batch_op.drop_column('jti')
+        batch_op.add_column(sa.Column('token', sa.String(length=1000), nullable=True))
+        batch_op.create_index('ix_tokens_token', ['token'], unique=True)
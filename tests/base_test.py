@@ -1,8 +1,11 @@
-from api import app, db
-from config import app_config
+from api import create_app, db
 from api.models import User
+from api.cache import user_cache, response_cache
+from api.revocation import revoked_tokens
+from api.instrumentation import count_queries
 
 import unittest
+from contextlib import contextmanager
 from flask import json
 
 
@@ -11,13 +14,15 @@ class TestHelloBooks(unittest.TestCase):
 
     def setUp(self):
         """Set up function before any test runs"""
-        self.app = app
+        self.app = create_app('testing')
         self.version = '/api/v1'
-        app.config.from_object(app_config['testing'])
         self.client = self.app.test_client()
         self.app_context = self.app.app_context()
         self.app_context.push()
         db.create_all()
+        user_cache.clear()
+        response_cache.clear()
+        revoked_tokens.clear()
 
         # Registration Test Data
         self.user_data = {
@@ -261,6 +266,15 @@ class TestHelloBooks(unittest.TestCase):
         db.drop_all()
         self.app_context.pop()
 
+    @contextmanager
+    def assertMaxQueries(self, n):
+        """Fails if the block runs more than n SQL statements, catches N+1 queries"""
+        with count_queries() as statements:
+            yield statements
+        if len(statements) > n:
+            self.fail("{} queries run, expected at most {}:\n{}".format(
+                len(statements), n, '\n'.join(statements)))
+
     def register_user(self, data):
         return self.client.post(self.version+'/auth/register', data=json.dumps(data), content_type='application/json')
 
@@ -276,6 +290,9 @@ class TestHelloBooks(unittest.TestCase):
     def get_all_books(self):
         return self.client.get(self.version+'/books')
 
+    def search_books(self, q, page=1, limit=10):
+        return self.client.get(self.version+'/books', query_string={"q": q, "page": page, "limit": limit})
+
     def get_book(self, id):
         return self.client.get(self.version+'/book/' + str(id))
 
@@ -289,6 +306,13 @@ class TestHelloBooks(unittest.TestCase):
                                 data=json.dumps(data), headers={"Authorization": "Bearer {}".format(token)},
                                 content_type='application/json')
 
+    def import_books(self, data, content_type='text/csv'):
+        admin = self.login_admin()
+        token = json.loads(admin.data)['Token']
+        return self.client.post(self.version+'/books/import', data=data,
+                                headers={"Authorization": "Bearer {}".format(token)},
+                                content_type=content_type)
+
     def update_book(self, data, id):
         admin = self.login_admin()
         token = json.loads(admin.data)['Token']
@@ -299,13 +323,46 @@ class TestHelloBooks(unittest.TestCase):
         token = json.loads(admin.data)['Token']
         return self.client.delete(self.version+'/book/'+str(id), headers={"Authorization": "Bearer {}".format(token)}, content_type='application/json')
 
-    def get_all_users(self):
+    def get_all_users(self, accept=None, **args):
         admin = self.login_admin()
         token = json.loads(admin.data)['Token']
-        return self.client.get(self.version+'/users', headers={"Authorization": "Bearer {}".format(token)}, content_type='application/json')
+        headers = {"Authorization": "Bearer {}".format(token)}
+        if accept:
+            headers["Accept"] = accept
+        return self.client.get(self.version+'/users', query_string=args, headers=headers, content_type='application/json')
 
     def review_book(self, id):
         self.register_user(self.user_data)
         user = self.login_user(self.login_data)
         token = json.loads(user.data)['Token']
-        return self.client.post(self.version+'/users/books/'+ str(id), headers={"Authorization": "Bearer {}".format(token)}, content_type='application/json')
\ No newline at end of file
+        return self.client.post(self.version+'/users/books/'+ str(id), headers={"Authorization": "Bearer {}".format(token)}, content_type='application/json')
+
+    def user_token(self):
+        self.register_user(self.user_data)
+        user = self.login_user(self.login_data)
+        return json.loads(user.data)['Token']
+
+    def return_book(self, id, token):
+        return self.client.put(self.version+'/users/books/'+ str(id), headers={"Authorization": "Bearer {}".format(token)}, content_type='application/json')
+
+    def batch_books(self, token, books, method='post'):
+        return self.client.open(self.version+'/users/books', method=method.upper(), data=json.dumps({"books": books}), headers={"Authorization": "Bearer {}".format(token)}, content_type='application/json')
+
+    def review_history(self, token, **args):
+        return self.client.get(self.version+'/users/books', query_string=args, headers={"Authorization": "Bearer {}".format(token)})
+
+    def outstanding_reviews(self, **args):
+        admin = self.login_admin()
+        token = json.loads(admin.data)['Token']
+        return self.client.get(self.version+'/reviews/outstanding', query_string=args, headers={"Authorization": "Bearer {}".format(token)})
+
+    def promote_user(self, username):
+        admin = self.login_admin()
+        token = json.loads(admin.data)['Token']
+        return self.client.post(self.version+'/user/promote', data=json.dumps({"username": username}), headers={"Authorization": "Bearer {}".format(token)}, content_type='application/json')
+
+    def set_roles(self, usernames, is_admin=True, token=None):
+        if token is None:
+            admin = self.login_admin()
+            token = json.loads(admin.data)['Token']
+        return self.client.post(self.version+'/users/roles', data=json.dumps({"usernames": usernames, "is_admin": is_admin}), headers={"Authorization": "Bearer {}".format(token)}, content_type='application/json')
@@ -1,7 +1,14 @@
 """File contains tests for auth api endpoints"""
 
 from tests.base_test import TestHelloBooks
+from api.hashing import hash_password, needs_rehash
+from api.revocation import revoked_tokens
+from api.models import Token, Revoked, User
+from api.pruning import prune_tokens
+from datetime import datetime, timedelta
 import json
+from unittest import mock
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS
 
 
 class AuthTestCase(TestHelloBooks):
@@ -44,6 +51,37 @@ class AuthTestCase(TestHelloBooks):
         pass_mismatch = self.register_user(self.user_data_password_mismatch)
         self.assertEqual(pass_mismatch.status_code, 400)
 
+    def test_registration_queries(self):
+        """Tests registration checks the email and username in one query"""
+        with self.assertMaxQueries(2):
+            registered = self.register_user(self.user_data)
+        self.assertEqual(registered.status_code, 201)
+        with self.assertMaxQueries(1):
+            taken = self.register_user(self.user_data)
+        self.assertEqual(taken.status_code, 409)
+
+    def test_login_validation(self):
+        """Tests login data failing the pre-check still gets schema errors"""
+        self.register_user(self.user_data)
+        extra_field = self.login_user(dict(self.login_data, remember=True))
+        self.assertEqual(extra_field.status_code, 400)
+        self.assertIn('remember', json.loads(extra_field.data))
+        no_password = self.login_user({"username": "zootest"})
+        self.assertEqual(json.loads(no_password.data), {"password": ["required field"]})
+        not_an_object = self.login_user(["zootest", "password1234"])
+        self.assertEqual(not_an_object.status_code, 400)
+        self.assertEqual(self.login_user(self.login_data).status_code, 200)
+
+    def test_registration_race(self):
+        """Tests the unique indexes reject a sign-up that passed the existence check"""
+        self.assertEqual(self.register_user(self.user_data).status_code, 201)
+        with mock.patch.object(User, 'taken_fields', side_effect=[set(), {'username'}]):
+            race = self.register_user(dict(self.user_data, email="other@yahoo.com"))
+        self.assertEqual(race.status_code, 409)
+        self.assertEqual(json.loads(race.data)['Message'], "Username provided already exists")
+        self.assertEqual(self.register_user(dict(self.user_data, username="other")).status_code, 409)
+        self.assertEqual(User.query.count(), 2)
+
     def test_login(self):
         """Tests Login User API endpoint"""
         self.register_user(self.user_data)
@@ -58,4 +96,77 @@ class AuthTestCase(TestHelloBooks):
         logout = self.logout_user(login)
         self.assertEqual(logout.status_code, 200)
         logout2 = self.logout_user(login2)
-        self.assertEqual(logout2.status_code, 200)
\ No newline at end of file
+        self.assertEqual(logout2.status_code, 200)
+
+    def test_revoked_token(self):
+        """Tests a logged out token is rejected"""
+        self.register_user(self.user_data)
+        login = self.login_user(self.login_data)
+        token = json.loads(login.data)['Token']
+        headers = {"Authorization": "Bearer {}".format(token)}
+        self.assertEqual(self.client.get(self.version+'/user', headers=headers).status_code, 200)
+        self.assertEqual(self.logout_user(login).status_code, 200)
+        self.assertEqual(self.client.get(self.version+'/user', headers=headers).status_code, 401)
+        self.assertEqual(self.logout_user(login).status_code, 401)
+        revoked_tokens.clear()
+        self.assertEqual(self.client.get(self.version+'/user', headers=headers).status_code, 401)
+
+    def test_revocation_committed_late(self):
+        """Tests a revocation committed after one with a higher id is still picked up"""
+        expires = datetime.utcnow() + timedelta(hours=1)
+        revoked_tokens.refresh()
+        later = Revoked('later-revocation', expires)
+        later.id = 2
+        later.save()
+        revoked_tokens.refresh()
+        self.assertIn('later-revocation', revoked_tokens)
+        earlier = Revoked('earlier-revocation', expires)
+        earlier.id = 1
+        earlier.save()
+        revoked_tokens.refresh()
+        self.assertIn('earlier-revocation', revoked_tokens)
+
+    def test_prune_tokens(self):
+        """Tests expired tokens and revocations are pruned in batches"""
+        login = self.login_admin()
+        expired = datetime.utcnow() - timedelta(days=1)
+        for n in range(5):
+            Token('expired-token-{}'.format(n), 'zooken', expired).save()
+            Revoked('expired-revoked-{}'.format(n), expired).save()
+        self.assertEqual(prune_tokens(batch_size=2), {"tokens": 5, "revoked": 5})
+        self.assertEqual(len(Token.all_tokens()), 1)
+        self.assertEqual(Revoked.query.count(), 0)
+        self.assertEqual(self.logout_user(login).status_code, 200)
+        self.assertEqual(Token.query.count(), 0)
+        self.assertEqual(prune_tokens(), {"tokens": 0, "revoked": 0})
+
+    def test_rehash_on_login(self):
+        """Tests a hash made with old cost settings is upgraded on login"""
+        self.register_user(self.user_data)
+        self.assertEqual(User.get_user_by_username('zootest').secure_password.split('$')[0], 'pbkdf2:sha256:1000')
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:2000'
+        self.assertEqual(self.login_user(self.login_data).status_code, 200)
+        self.assertEqual(User.get_user_by_username('zootest').secure_password.split('$')[0], 'pbkdf2:sha256:2000')
+        self.assertEqual(self.login_user(self.login_data).status_code, 200)
+
+    def test_no_rehash_for_same_method(self):
+        """Tests a configured method without iterations matches the hashes werkzeug makes with it"""
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256'
+        pwhash = hash_password('password1234')
+        self.assertTrue(pwhash.startswith('pbkdf2:sha256:{}$'.format(DEFAULT_PBKDF2_ITERATIONS)))
+        self.assertFalse(needs_rehash(pwhash))
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:{}'.format(DEFAULT_PBKDF2_ITERATIONS)
+        self.assertFalse(needs_rehash(pwhash))
+        self.app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha512'
+        self.assertTrue(needs_rehash(pwhash))
+
+    def test_reset_password(self):
+        """Tests Reset Password API endpoint"""
+        self.register_user(self.user_data)
+        token = json.loads(self.login_user(self.login_data).data)['Token']
+        reset = self.client.post(self.version+'/auth/reset-password', data=json.dumps({
+            "password": "password1234", "new_password": "newpassword1234", "confirm_password": "newpassword1234"}),
+            headers={"Authorization": "Bearer {}".format(token)}, content_type='application/json')
+        self.assertEqual(reset.status_code, 200)
+        self.assertEqual(self.login_user(self.login_data).status_code, 401)
+        self.assertEqual(self.login_user(dict(self.login_data, password="newpassword1234")).status_code, 200)
@@ -1,7 +1,13 @@
 """File contains tests for all book api endpoints"""
 
 from tests.base_test import TestHelloBooks
+from api.models import Book
+from api.search import search
+from api.responses import stdlib_dumps, orjson_dumps, orjson
+from datetime import date
 import json
+import unittest
+from unittest import mock
 
 class BookTestCase(TestHelloBooks):
     """Test class for all book api endpoints"""
@@ -40,6 +46,22 @@ class BookTestCase(TestHelloBooks):
         add_book2 = self.add_book(self.book_data)
         self.assertEqual(add_book2.status_code, 409)
 
+    def test_add_book_queries(self):
+        """Tests adding a book does not look the book up again"""
+        token = json.loads(self.login_admin().data)['Token']
+        headers = {"Authorization": "Bearer {}".format(token)}
+        self.client.get(self.version + '/user', headers=headers)
+        # One query checks the admin role on the primary
+        with self.assertMaxQueries(3):
+            added = self.client.post(self.version + '/books', data=json.dumps(self.book_data),
+                                     headers=headers, content_type='application/json')
+        self.assertEqual(added.status_code, 201)
+        self.assertEqual(json.loads(added.data)['Book']['isbn'], self.book_data['isbn'])
+        with self.assertMaxQueries(2):
+            duplicate = self.client.post(self.version + '/books', data=json.dumps(self.book_data),
+                                         headers=headers, content_type='application/json')
+        self.assertEqual(duplicate.status_code, 409)
+
     def test_update_book(self):
         """Tests update book api endpoint"""
         self.add_book(self.book_data)
@@ -69,3 +91,144 @@ class BookTestCase(TestHelloBooks):
         self.assertEqual(no_book.status_code, 404)
         delete_book = self.delete_book(1)
         self.assertEqual(delete_book.status_code, 200)
+
+    def test_import_books(self):
+        """Tests bulk import books api endpoint"""
+        self.add_book(self.book_data)
+        csv_data = "title,author,isbn,publisher,quantity\n" \
+                   "The Hobbit,J. R. R. Tolkien,9780261102217,Harper,3\n" \
+                   "Duplicate In File,Someone,9780261102217,Harper,1\n" \
+                   "Already Added,Someone,3652472876,Publisher,1\n" \
+                   ",No Title,9780261102218,Harper,1\n" \
+                   "Dune,Frank Herbert,9780441013593,Ace,many\n"
+        csv_import = self.import_books(csv_data)
+        self.assertEqual(csv_import.status_code, 200)
+        report = json.loads(csv_import.data)
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['rejected'], 4)
+        self.assertEqual(sorted(error['line'] for error in report['errors']), [3, 4, 5, 6])
+        jsonl_data = '{"title": "Dune", "author": "Frank Herbert", "isbn": "9780441013593", ' \
+                     '"publisher": "Ace", "quantity": 2}\nnot json\n' \
+                     '{"title": "Emma", "author": "Jane Austen", "isbn": "9780141439587", ' \
+                     '"publisher": "Penguin", "quantity": 3.7}\n'
+        jsonl_import = self.import_books(jsonl_data, 'application/x-ndjson')
+        report = json.loads(jsonl_import.data)
+        self.assertEqual(report['imported'], 1)
+        self.assertEqual(report['rejected'], 2)
+        self.assertEqual(report['errors'][-1], {"line": 3, "isbn": "9780141439587",
+                                                "errors": {"quantity": ["must be an integer"]}})
+        self.assertEqual(self.get_book(3).status_code, 200)
+        no_data = self.import_books('')
+        self.assertEqual(no_data.status_code, 400)
+
+    def test_import_books_unreadable(self):
+        """Tests an import that is not UTF-8 is rejected"""
+        latin1 = "title,author,isbn,publisher,quantity\nLes Misérables,Victor Hugo,9782253096337,Poche,1\n"
+        res = self.import_books(latin1.encode('latin-1'))
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(json.loads(res.data)['imported'], 0)
+        self.assertEqual(Book.query.count(), 0)
+
+    def test_import_books_concurrent_insert(self):
+        """Tests a batch whose ISBN was added after the lookup imports its other rows"""
+        self.add_book(self.book_data)
+        csv_data = "title,author,isbn,publisher,quantity\n" \
+                   "The Hobbit,J. R. R. Tolkien,9780261102217,Harper,3\n" \
+                   "Added Meanwhile,Someone,3652472876,Publisher,1\n"
+        with mock.patch('api.admin.importer._existing_isbns', return_value=set()):
+            res = self.import_books(csv_data)
+        self.assertEqual(res.status_code, 200)
+        report = json.loads(res.data)
+        self.assertEqual((report['imported'], report['rejected']), (1, 1))
+        self.assertEqual(report['errors'][0]['line'], 3)
+        self.assertEqual(Book.query.count(), 2)
+
+    def test_search_books(self):
+        """Tests ranked search on the get books api endpoint"""
+        self.add_book(self.book_data)
+        self.import_books("title,author,isbn,publisher,quantity\n"
+                          "The Naked Face,Sidney Sheldon,9780446356657,Warner,2\n"
+                          "Gods of the Windmill,Somebody Else,9780000000001,Sheldon House,1\n")
+        windmills = self.search_books("windmills gods")
+        self.assertEqual(windmills.status_code, 200)
+        titles = [book['title'] for book in json.loads(windmills.data)['Books']]
+        self.assertEqual(titles, ["Windmills Of Gods", "Gods Of The Windmill"])
+        sheldon = json.loads(self.search_books("sheldon").data)
+        self.assertEqual(len(sheldon['Books']), 3)
+        self.assertEqual(sheldon['Books'][-1]['title'], "Gods Of The Windmill")
+        second_page = json.loads(self.search_books("sheldon", page=2, limit=2).data)
+        self.assertEqual(second_page['totalPages'], 2)
+        self.assertEqual(second_page['currentPage'], 2)
+        self.assertEqual(len(second_page['Books']), 1)
+        self.update_book(dict(self.update_book_data, title="Renamed"), 1)
+        self.assertEqual(json.loads(self.search_books("windmills").data)['Books'][0]['id'], 3)
+        missing = json.loads(self.search_books("nothing matches").data)
+        self.assertEqual(missing['Books'], [])
+        clamped = search(Book, "sheldon", page=0, per_page=0)
+        self.assertEqual((clamped.page, clamped.per_page, len(clamped.items)), (1, 1, 1))
+
+    def test_get_books_after_cursor(self):
+        """Tests keyset pagination on the get books api endpoint"""
+        self.import_books("title,author,isbn,publisher,quantity\n" + "".join(
+            "Book {0},Author {1},978000000000{0},Publisher,1\n".format(n, 5 - n) for n in range(5)))
+        seen = []
+        after = ""
+        while after is not None:
+            page = self.client.get(self.version+'/books', query_string={"after": after, "limit": 2})
+            self.assertEqual(page.status_code, 200)
+            page = json.loads(page.data)
+            self.assertNotIn("totalBooks", page)
+            seen += [book['id'] for book in page['Books']]
+            after = page['nextCursor']
+        self.assertEqual(seen, [1, 2, 3, 4, 5])
+        by_author = json.loads(self.client.get(self.version+'/books', query_string={
+            "after": "", "limit": 3, "sort": "author", "count": "true"}).data)
+        self.assertEqual([book['id'] for book in by_author['Books']], [5, 4, 3])
+        self.assertEqual(by_author['totalBooks'], 5)
+        next_page = json.loads(self.client.get(self.version+'/books', query_string={
+            "after": by_author['nextCursor'], "limit": 3, "sort": "author"}).data)
+        self.assertEqual([book['id'] for book in next_page['Books']], [2, 1])
+        self.assertIsNone(next_page['nextCursor'])
+        wrong_sort = self.client.get(self.version+'/books', query_string={
+            "after": by_author['nextCursor'], "sort": "title"})
+        self.assertEqual(wrong_sort.status_code, 400)
+        bad_cursor = self.client.get(self.version+'/books', query_string={"after": "garbage"})
+        self.assertEqual(bad_cursor.status_code, 400)
+        for args in ({"after": "", "limit": 0}, {"after": "", "limit": -3}, {"page": "abc"},
+                     {"page": 0}, {"limit": 1001}, {"q": "book", "limit": "x"}):
+            self.assertEqual(self.client.get(self.version+'/books', query_string=args).status_code, 400)
+
+    def test_conditional_get_books(self):
+        """Tests ETags on book reads and their invalidation on writes"""
+        self.add_book(self.book_data)
+        book = self.get_book(1)
+        etag = book.headers['ETag']
+        self.assertEqual(book.status_code, 200)
+        not_modified = self.client.get(self.version+'/book/1', headers={"If-None-Match": etag})
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.data, b'')
+        listing = self.get_all_books()
+        listing_etag = listing.headers['ETag']
+        self.assertEqual(self.client.get(self.version+'/books', headers={"If-None-Match": listing_etag}).status_code, 304)
+        self.review_book(1)
+        changed = self.client.get(self.version+'/book/1', headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(json.loads(changed.data)['quantity'], 44)
+        self.assertNotEqual(changed.headers['ETag'], etag)
+        self.update_book(dict(self.update_book_data, title="Renamed"), 1)
+        listing = self.client.get(self.version+'/books', headers={"If-None-Match": listing_etag})
+        self.assertEqual(json.loads(listing.data)['Books'][0]['title'], "Renamed")
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_response_encoders(self):
+        """Tests orjson and the standard library produce the same documents"""
+        self.add_book(self.book_data)
+        book = Book.get_book_by_id(1)
+        payload = {"Book": book.serialize, "reviewDate": date(2021, 9, 29),
+                   "books": [{0: ["must be of integer type"]}]}
+        self.assertEqual(json.loads(orjson_dumps(payload)), json.loads(stdlib_dumps(payload)))
+        self.assertEqual(json.loads(orjson_dumps(payload))['reviewDate'], "Wed, 29 Sep 2021 00:00:00 GMT")
+        self.assertTrue(payload['Book']['availability'])
+        self.assertNotIn('availability', vars(book))
+        response = self.get_book(1)
+        self.assertEqual(response.mimetype, 'application/json')
@@ -0,0 +1,87 @@
+"""File contains tests for the metrics endpoint and its instrumentation"""
+
+from tests.base_test import TestHelloBooks
+from api import create_app
+from api.pooling import MeteredQueuePool, engine_options
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, exc
+
+
+class MetricsTestCase(TestHelloBooks):
+    """Test Class for metrics"""
+
+    @staticmethod
+    def sample(name, **labels):
+        """Reads a metric sample, 0 when it was never recorded"""
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    def test_pool_metrics(self):
+        """Tests checkouts, overflow and timeouts of the metered pool are recorded"""
+        engine = create_engine('sqlite://', poolclass=MeteredQueuePool, pool_size=1, max_overflow=1,
+                               pool_timeout=0.1, pool_logging_name='test_pool',
+                               connect_args={'check_same_thread': False})
+        waits = self.sample('db_pool_checkout_wait_seconds_count', pool='test_pool')
+        overflow = self.sample('db_pool_overflow_total', pool='test_pool')
+        timeouts = self.sample('db_pool_checkout_timeouts_total', pool='test_pool')
+        first = engine.connect()
+        second = engine.connect()
+        self.assertEqual(self.sample('db_pool_connections_in_use', pool='test_pool'), 2)
+        self.assertEqual(self.sample('db_pool_overflow_total', pool='test_pool'), overflow + 1)
+        with self.assertRaises(exc.TimeoutError):
+            engine.connect()
+        self.assertEqual(self.sample('db_pool_checkout_timeouts_total', pool='test_pool'), timeouts + 1)
+        first.close()
+        second.close()
+        self.assertEqual(self.sample('db_pool_connections_in_use', pool='test_pool'), 0)
+        self.assertEqual(self.sample('db_pool_checkout_wait_seconds_count', pool='test_pool'), waits + 3)
+        engine.dispose()
+
+    def test_engine_options(self):
+        """Tests pool settings only apply to server databases"""
+        config = dict(self.app.config, DB_STATEMENT_TIMEOUT=5000)
+        server = engine_options(config, 'postgresql://localhost/library')
+        self.assertIs(server['poolclass'], MeteredQueuePool)
+        self.assertEqual(server['pool_size'], config['DB_POOL_SIZE'])
+        self.assertEqual(server['connect_args'], {'options': '-c statement_timeout=5000'})
+        sqlite = engine_options(config, 'sqlite:///library.db')
+        self.assertNotIn('poolclass', sqlite)
+        self.assertNotIn('pool_size', sqlite)
+
+    def test_request_metrics(self):
+        """Tests requests are counted and timed per endpoint"""
+        served = self.sample('http_requests_total', endpoint='api.getbooks', method='GET', status='404')
+        timed = self.sample('http_request_duration_seconds_count', endpoint='api.getbooks', method='GET')
+        db_timed = self.sample('http_request_db_seconds_count', endpoint='api.getbooks', method='GET')
+        self.client.get(self.version + '/books')
+        self.assertEqual(
+            self.sample('http_requests_total', endpoint='api.getbooks', method='GET', status='404'),
+            served + 1)
+        self.assertEqual(
+            self.sample('http_request_duration_seconds_count', endpoint='api.getbooks', method='GET'),
+            timed + 1)
+        self.assertEqual(
+            self.sample('http_request_db_seconds_count', endpoint='api.getbooks', method='GET'),
+            db_timed + 1)
+        self.assertGreater(
+            self.sample('http_request_db_seconds_sum', endpoint='api.getbooks', method='GET'), 0)
+        unmatched = self.sample('http_requests_total', endpoint='unmatched', method='GET', status='404')
+        self.client.get('/no/such/route')
+        self.assertEqual(
+            self.sample('http_requests_total', endpoint='unmatched', method='GET', status='404'),
+            unmatched + 1)
+
+    def test_debug_query_headers(self):
+        """Tests debug responses carry their query count and SQL time"""
+        res = self.client.get(self.version + '/books')
+        self.assertEqual(res.headers['X-Query-Count'], '1')
+        self.assertTrue(res.headers['Server-Timing'].startswith('db;desc="1 queries";dur='))
+        production = create_app('production')
+        self.assertNotIn('X-Query-Count', production.test_client().get('/metrics').headers)
+
+    def test_metrics_endpoint(self):
+        """Tests metrics are served in the Prometheus text format"""
+        res = self.client.get('/metrics')
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(res.content_type.startswith('text/plain'))
+        self.assertIn(b'db_pool_checkout_wait_seconds', res.data)
+        self.assertIn(b'http_request_duration_seconds', res.data)
@@ -0,0 +1,172 @@
+"""File contains tests for routing reads to replicas"""
+
+import os
+import shutil
+import tempfile
+import time
+
+from tests.base_test import TestHelloBooks
+from api import db
+from api.models import User
+from api.replicas import STICKY_COOKIE, recent_writers, replica_set
+from api.revocation import revoked_tokens
+from flask import json
+from prometheus_client import REGISTRY
+from sqlalchemy import event, exc
+from sqlalchemy.orm import Session
+
+
+class ReplicaTestCase(TestHelloBooks):
+    """
+    Test Class for read replicas. Most tests use a second engine on the
+    test database as the replica, so they run on any backend.
+    """
+
+    def setUp(self):
+        """Set up function, the replicas are configured by each test"""
+        super().setUp()
+        self.primary_url = db.engine.url.render_as_string(hide_password=False)
+        self.replica_dir = tempfile.mkdtemp()
+        # SQLite can always be imported, and fails to open a file in a missing directory
+        self.unreachable_url = 'sqlite:///' + os.path.join(self.replica_dir, 'missing', 'replica.db')
+        self.app.config.update(DB_REPLICA_URLS=[self.primary_url], DB_REPLICA_STICKY_SECONDS=0.5)
+
+    def tearDown(self):
+        """Drops the replicas"""
+        replica_set(self.app).dispose()
+        recent_writers.clear()
+        shutil.rmtree(self.replica_dir)
+        super().tearDown()
+
+    def replica_statements(self, replica=0):
+        """Collects the statements run on a replica"""
+        statements = []
+        event.listen(replica_set(self.app).replicas[replica].engine, 'before_cursor_execute',
+                     lambda conn, cursor, statement, *args: statements.append(statement))
+        return statements
+
+    def admin_token(self):
+        """Logs the admin in, without keeping the cookie the login write set"""
+        token = json.loads(self.login_admin().data)['Token']
+        self.client.cookie_jar.clear()
+        return token
+
+    def usernames(self, token):
+        """Lists the usernames the admin sees"""
+        res = self.client.get(self.version + '/users', headers={"Authorization": "Bearer {}".format(token)})
+        self.assertEqual(res.status_code, 200)
+        return {user['username'] for user in json.loads(res.data)['Users']}
+
+    def test_routing(self):
+        """Tests which statements go to the replica"""
+        statements = self.replica_statements()
+        token = self.admin_token()
+        self.assertEqual(statements, [])
+        revoked_tokens.clear()
+        self.assertEqual(self.usernames(token), {'zooken'})
+        self.assertTrue(any('FROM users' in statement for statement in statements))
+        # Revocations and identities are always read from the primary
+        self.assertFalse(any('revoked' in statement or 'users.username =' in statement for statement in statements))
+
+        # The writer's reads stay on the primary for the sticky window
+        del statements[:]
+        self.set_roles(['zooken'], token=token)
+        self.assertEqual({cookie.name for cookie in self.client.cookie_jar}, {STICKY_COOKIE})
+        self.usernames(token)
+        self.client.cookie_jar.clear()
+        self.usernames(token)
+        self.assertEqual(statements, [])
+        time.sleep(0.6)
+        self.usernames(token)
+        self.assertNotEqual(statements, [])
+
+    def test_replica_failure(self):
+        """Tests a read that finds its replica down is run on the primary"""
+        self.app.config['DB_REPLICA_URLS'] = [self.unreachable_url]
+        token = self.admin_token()
+        replica = replica_set(self.app).replicas[0]
+        self.assertTrue(replica.healthy)
+        self.assertEqual(self.usernames(token), {'zooken'})
+        self.assertFalse(replica.healthy)
+        self.assertEqual(self.usernames(token), {'zooken'})
+
+    def test_replica_health(self):
+        """Tests reads go round-robin over healthy replicas and fall back to the primary"""
+        self.app.config['DB_REPLICA_URLS'] = [self.primary_url, self.primary_url, self.unreachable_url]
+        replicas = replica_set(self.app)
+        good, other, bad = replicas.replicas
+        self.assertEqual([replicas.choose() for _ in range(4)], [good, other, bad, good])
+
+        replicas.check(self.app.config['DB_REPLICA_MAX_LAG'])
+        self.assertTrue(good.healthy)
+        self.assertFalse(bad.healthy)
+        self.assertEqual(REGISTRY.get_sample_value('db_replica_up', {'replica': bad.name}), 0)
+        self.assertNotIn(bad, [replicas.choose() for _ in range(4)])
+
+        # A failed connection takes a replica out too
+        bad.mark(True)
+        with self.assertRaises(exc.OperationalError):
+            bad.engine.connect()
+        self.assertFalse(bad.healthy)
+        good.mark(False)
+        other.mark(False)
+        self.assertIsNone(replicas.choose())
+        statements = self.replica_statements()
+        self.usernames(self.admin_token())
+        self.assertEqual(statements, [])
+
+    def lagging_replica(self):
+        """Uses a copy of the test database as the replica, it never sees later writes"""
+        url = db.engine.url
+        if url.get_backend_name() != 'sqlite' or not url.database:
+            self.skipTest("the lagging replica is a copy of the SQLite database file")
+        db.session.close()
+        path = os.path.join(self.replica_dir, 'replica.db')
+        shutil.copy(url.database, path)
+        self.app.config['DB_REPLICA_URLS'] = ['sqlite:///' + path]
+
+    def test_reads_your_writes(self):
+        """Tests a lagging replica's data is only read by users who did not just write"""
+        self.lagging_replica()
+        with Session(replica_set(self.app).replicas[0].engine) as session:
+            session.add(User('replicaonly@yahoo.com', 'replicaonly', 'Replica', 'Only', 'password1234'))
+            session.commit()
+        token = self.admin_token()
+        self.assertIn('replicaonly', self.usernames(token))
+
+        # Writes go to the primary, the writer's next reads follow them there
+        self.register_user(self.user_data)
+        names = self.usernames(token)
+        self.assertIn('zootest', names)
+        self.assertNotIn('replicaonly', names)
+        # Only the cookie knew about the anonymous write. The test's app context
+        # kept the admin's JWT though, so the admin was taken for the writer.
+        self.client.cookie_jar.clear()
+        recent_writers.clear()
+        names = self.usernames(token)
+        self.assertIn('replicaonly', names)
+        self.assertNotIn('zootest', names)
+
+    def test_cached_reads_your_writes(self):
+        """Tests the response cache neither serves a writer nor keeps what a lagging replica read"""
+        self.add_book(self.book_data)
+        self.lagging_replica()
+        self.update_book(dict(self.update_book_data, title="Renamed"), 1)
+        self.client.cookie_jar.clear()
+        # The test's app context kept the admin's JWT, see test_reads_your_writes
+        recent_writers.clear()
+        title = lambda: json.loads(self.get_book(1).data)['title']
+        self.assertEqual(title(), "Windmills Of Gods")
+
+        self.client.set_cookie('localhost', STICKY_COOKIE, '{:.3f}'.format(time.time() + 5))
+        self.assertEqual(title(), "Renamed")
+        self.client.cookie_jar.clear()
+        self.assertEqual(title(), "Windmills Of Gods")
+
+        # Once the catalog settled, replica reads are cached again
+        time.sleep(0.6)
+        statements = self.replica_statements()
+        self.assertEqual(title(), "Windmills Of Gods")
+        del statements[:]
+        self.assertEqual(title(), "Windmills Of Gods")
+        self.assertEqual(statements, [])
@@ -1,5 +1,12 @@
 from tests.base_test import TestHelloBooks
+from api import db
+from api.cache import user_cache
+from api.models import User, Book, ReviewBook, BatchConflict
+from datetime import date
+from flask_jwt_extended import create_access_token
+from concurrent.futures import ThreadPoolExecutor
 import json
+from unittest import mock
 
 
 class UserTestCase(TestHelloBooks):
@@ -9,6 +16,231 @@ class UserTestCase(TestHelloBooks):
         all_users = self.get_all_users()
         self.assertEqual(all_users.status_code, 200)
 
+    def test_list_users(self):
+        for n, joined in enumerate([date(2021, 1, 10), date(2021, 3, 5), date(2021, 6, 1)]):
+            reader = User('reader{}@yahoo.com'.format(n), 'reader{}'.format(n), 'Reader', 'Gang', 'password1234')
+            reader.joined = joined
+            reader.save()
+        User.query.filter_by(username='reader1').update({"is_admin": True})
+        db.session.commit()
+        everyone = json.loads(self.get_all_users().data)['Users']
+        self.assertEqual([row['username'] for row in everyone], ['zooken', 'reader0', 'reader1', 'reader2'])
+        first = json.loads(self.get_all_users(limit=2).data)
+        self.assertEqual([row['username'] for row in first['Users']], ['zooken', 'reader0'])
+        rest = json.loads(self.get_all_users(limit=2, after=first['nextCursor']).data)
+        self.assertEqual([row['username'] for row in rest['Users']], ['reader1', 'reader2'])
+        self.assertIsNone(rest['nextCursor'])
+        admins = json.loads(self.get_all_users(admin='true', name='read').data)['Users']
+        self.assertEqual([row['username'] for row in admins], ['reader1'])
+        joined = json.loads(self.get_all_users(joined_from='2021-02-01', joined_to='2021-12-31').data)['Users']
+        self.assertEqual([row['username'] for row in joined], ['reader1', 'reader2'])
+        self.assertEqual(self.get_all_users(name='100%').status_code, 404)
+        ndjson = self.get_all_users(format='ndjson', admin='false')
+        self.assertEqual(ndjson.mimetype, 'application/x-ndjson')
+        lines = ndjson.data.decode().splitlines()
+        self.assertEqual([json.loads(line)['username'] for line in lines], ['reader0', 'reader2'])
+        accepted = self.get_all_users(accept='application/x-ndjson')
+        self.assertEqual(len(accepted.data.decode().splitlines()), 4)
+        self.assertEqual(self.get_all_users(admin='yes').status_code, 400)
+        self.assertEqual(self.get_all_users(joined_from='last week').status_code, 400)
+        self.assertEqual(self.get_all_users(limit=0).status_code, 400)
+        self.assertEqual(self.get_all_users(after='bogus').status_code, 400)
+
+    def test_promoted_user_identity(self):
+        token = self.user_token()
+        headers = {"Authorization": "Bearer {}".format(token)}
+        me = self.client.get(self.version+'/user', headers=headers)
+        self.assertFalse(json.loads(me.data)['User']['is_admin'])
+        not_admin = self.client.get(self.version+'/users', headers=headers)
+        self.assertEqual(not_admin.status_code, 401)
+        self.promote_user('zootest')
+        admin = self.client.get(self.version+'/users', headers=headers)
+        self.assertEqual(admin.status_code, 200)
+        me = self.client.get(self.version+'/user', headers=headers)
+        self.assertTrue(json.loads(me.data)['User']['is_admin'])
+
+    def test_promote_unknown_user(self):
+        res = self.promote_user('nobody')
+        self.assertEqual(res.status_code, 404)
+
+    def test_bulk_roles(self):
+        token = self.user_token()
+        headers = {"Authorization": "Bearer {}".format(token)}
+        self.client.get(self.version+'/user', headers=headers)
+        for n in range(3):
+            User('staff{}@yahoo.com'.format(n), 'staff{}'.format(n), 'Staff', 'Gang', 'password1234').save()
+        admin_token = json.loads(self.login_admin().data)['Token']
+        with self.assertMaxQueries(4):
+            res = self.set_roles(['ZooTest', 'staff0', 'staff1', 'staff2', 'nobody'], token=admin_token)
+        self.assertEqual(res.status_code, 200)
+        body = json.loads(res.data)
+        self.assertEqual(body['Updated'], ['staff0', 'staff1', 'staff2', 'zootest'])
+        self.assertEqual(body['NotFound'], ['nobody'])
+        # The cached identity of zootest must not keep the old role
+        admin = self.client.get(self.version+'/users', headers=headers)
+        self.assertEqual(admin.status_code, 200)
+        res = self.set_roles(['zootest'], is_admin=False)
+        self.assertEqual(json.loads(res.data)['Updated'], ['zootest'])
+        not_admin = self.client.get(self.version+'/users', headers=headers)
+        self.assertEqual(not_admin.status_code, 401)
+        self.assertEqual(self.set_roles([]).status_code, 400)
+        self.assertEqual(self.set_roles(['staff0'], is_admin='yes').status_code, 400)
+
+    def test_demoted_by_another_worker(self):
+        token = self.user_token()
+        headers = {"Authorization": "Bearer {}".format(token)}
+        self.promote_user('zootest')
+        self.assertEqual(self.client.get(self.version+'/users', headers=headers).status_code, 200)
+        # Another worker's demotion leaves the role cached in this one
+        db.session.execute(db.update(User).where(User.username == 'zootest').values(is_admin=False))
+        db.session.commit()
+        self.assertTrue(user_cache.get('zootest').is_admin)
+        # Reads trust the cached role, writes check it on the primary
+        with self.assertMaxQueries(1):
+            self.assertEqual(self.client.get(self.version+'/users', headers=headers).status_code, 200)
+        not_admin = self.client.post(self.version+'/books', data=json.dumps(self.book_data),
+                                     headers=headers, content_type='application/json')
+        self.assertEqual(not_admin.status_code, 401)
+        self.assertIsNone(user_cache.get('zootest'))
+        self.assertEqual(self.client.get(self.version+'/users', headers=headers).status_code, 401)
+
+    def test_last_admin(self):
+        self.user_token()
+        self.promote_user('zootest')
+        last = self.set_roles(['zooken', 'zootest'], is_admin=False)
+        self.assertEqual(last.status_code, 409)
+        self.assertEqual(User.query.filter_by(is_admin=True).count(), 2)
+        self.assertEqual(self.set_roles(['zootest'], is_admin=False).status_code, 200)
+        self.assertEqual(self.set_roles(['zooken'], is_admin=False).status_code, 409)
+        self.assertTrue(User.get_user_by_username('zooken').is_admin)
+
     def test_review_book(self):
         no_book = self.review_book(1000)
         self.assertEqual(no_book.status_code, 404)
+
+    def test_review_history(self):
+        token = self.user_token()
+        no_history = self.review_history(token)
+        self.assertEqual(no_history.status_code, 404)
+        self.add_book(self.book_data)
+        self.add_book(dict(self.book_data, title="The Naked Face", isbn="9780446356657"))
+        self.review_book(1)
+        self.review_book(2)
+        self.return_book(1, token)
+        history = self.review_history(token)
+        self.assertEqual(history.status_code, 200)
+        history = json.loads(history.data)['ReviewHistory']
+        self.assertEqual([book['id'] for book in history], [1, 2])
+        self.assertIn('reviewed_date', history[0])
+        self.assertNotIn('reviewed_date', history[1])
+        self.assertEqual(set(history[1]), {'id', 'title', 'author', 'isbn', 'review_date'})
+        second_page = json.loads(self.review_history(token, page=2, limit=1).data)['ReviewHistory']
+        self.assertEqual([book['id'] for book in second_page], [2])
+        future = self.review_history(token, **{"from": "2999-01-01"})
+        self.assertEqual(future.status_code, 404)
+        bad_date = self.review_history(token, to="yesterday")
+        self.assertEqual(bad_date.status_code, 400)
+        for args in ({"page": "x"}, {"page": 0}, {"limit": -1}, {"limit": 1001}):
+            self.assertEqual(self.review_history(token, **args).status_code, 400)
+
+    def test_return_once(self):
+        """Tests two returns of the same review put back one copy"""
+        token = self.user_token()
+        self.add_book(self.book_data)
+        self.review_book(1)
+        quantity = Book.query.get(1).quantity
+        review = ReviewBook.query.filter_by(book_id=1).first()
+        # Both returns got past the view's reviewed check
+        self.assertTrue(review.check_in())
+        self.assertFalse(review.check_in())
+        self.assertEqual(Book.query.get(1).quantity, quantity + 1)
+        self.assertEqual(self.return_book(1, token).status_code, 403)
+
+    def test_review_history_queries(self):
+        """Tests the review history takes the same number of queries for any number of books"""
+        token = self.user_token()
+        for n in range(5):
+            self.add_book(dict(self.book_data, title="Book {}".format(n), isbn="978044635665{}".format(n)))
+            self.review_book(n + 1)
+        with self.assertMaxQueries(1):
+            history = self.review_history(token)
+        self.assertEqual(len(json.loads(history.data)['ReviewHistory']), 5)
+
+    def test_outstanding_reviews(self):
+        token = self.user_token()
+        self.add_book(self.book_data)
+        self.add_book(dict(self.book_data, title="The Naked Face", isbn="9780446356657"))
+        nothing_due = self.review_history(token, reviewed="false")
+        self.assertEqual(nothing_due.status_code, 403)
+        self.review_book(1)
+        self.review_book(2)
+        self.return_book(1, token)
+        unreviewed = self.review_history(token, reviewed="false")
+        self.assertEqual(unreviewed.status_code, 200)
+        unreviewed = json.loads(unreviewed.data)['unreviewed']
+        self.assertEqual([book['id'] for book in unreviewed], [2])
+        self.assertIn('dueDate', unreviewed[0])
+        outstanding = self.outstanding_reviews()
+        self.assertEqual(outstanding.status_code, 200)
+        outstanding = json.loads(outstanding.data)
+        self.assertEqual([(row['username'], row['id']) for row in outstanding['Outstanding']], [('zootest', 2)])
+        self.assertEqual(outstanding['totalPages'], 1)
+        overdue = json.loads(self.outstanding_reviews(due_before="2000-01-01").data)
+        self.assertEqual(overdue['Outstanding'], [])
+        for args in ({"page": "x"}, {"page": 0}, {"limit": 0}, {"limit": 1001}):
+            self.assertEqual(self.outstanding_reviews(**args).status_code, 400)
+        not_admin = self.client.get(self.version+'/reviews/outstanding', headers={"Authorization": "Bearer {}".format(token)})
+        self.assertEqual(not_admin.status_code, 401)
+
+    def test_batch_checkout_and_return(self):
+        token = self.user_token()
+        for n in range(20):
+            Book("Book {}".format(n), "Author", "97804463566{:02d}".format(n), "Publisher", 0 if n == 19 else 2).save()
+        self.batch_books(token, [1])
+        self.client.get(self.version+'/user', headers={"Authorization": "Bearer {}".format(token)})
+        with self.assertMaxQueries(4):
+            checkout = self.batch_books(token, list(range(1, 21)) + [99, 5])
+        self.assertEqual(checkout.status_code, 200)
+        results = json.loads(checkout.data)['Results']
+        self.assertEqual([result['id'] for result in results], list(range(1, 21)) + [99])
+        self.assertEqual((results[0]['status'], results[0]['Message']), (403, "Already reviewed book"))
+        self.assertEqual([result['status'] for result in results[1:19]], [200] * 18)
+        self.assertEqual((results[19]['status'], results[19]['Message']), (404, "Book not available to review"))
+        self.assertEqual((results[20]['status'], results[20]['Message']), (404, "Book does not exist"))
+        self.assertEqual(json.loads(checkout.data)['Message'], "18 of 21 books checked out")
+        self.assertEqual(Book.query.get(2).quantity, 1)
+        self.assertEqual(ReviewBook.query.filter_by(reviewed=False).count(), 19)
+        with self.assertMaxQueries(4):
+            returned = self.batch_books(token, [1, 2, 20, 99], method='put')
+        self.assertEqual([result['status'] for result in json.loads(returned.data)['Results']], [200, 200, 403, 404])
+        self.assertEqual(Book.query.get(2).quantity, 2)
+        self.assertEqual(ReviewBook.query.filter_by(reviewed=False).count(), 17)
+        self.assertEqual(self.batch_books(token, []).status_code, 400)
+        self.assertEqual(self.batch_books(token, ["one"]).status_code, 400)
+        self.assertEqual(self.batch_books(token, list(range(1, 102))).status_code, 400)
+
+    def test_batch_conflict(self):
+        token = self.user_token()
+        for method, name in (('post', 'checkout_many'), ('put', 'check_in_many')):
+            with mock.patch.object(ReviewBook, name, side_effect=BatchConflict):
+                res = self.batch_books(token, [1], method=method)
+            self.assertEqual(res.status_code, 409)
+            self.assertIn("Try again", json.loads(res.data)['Message'])
+
+    def test_concurrent_checkout(self):
+        copies, readers = 3, 12
+        self.add_book(dict(self.book_data, quantity=copies))
+        tokens = []
+        for n in range(readers):
+            User('reader{}@yahoo.com'.format(n), 'reader{}'.format(n), 'Reader', 'Gang', 'password1234').save()
+            tokens.append(create_access_token(identity='reader{}'.format(n)))
+
+        def checkout(token):
+            return self.client.post(self.version+'/users/books/1', headers={"Authorization": "Bearer {}".format(token)}).status_code
+
+        with ThreadPoolExecutor(max_workers=readers) as pool:
+            statuses = list(pool.map(checkout, tokens))
+        self.assertEqual(statuses.count(200), copies)
+        self.assertEqual(statuses.count(404), readers - copies)
+        self.assertEqual(Book.query.get(1).quantity, 0)
+        self.assertEqual(ReviewBook.query.count(), copies)